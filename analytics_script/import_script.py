@@ -15,6 +15,31 @@ def read_jsonl(file_path):
     with open(file_path, mode='r', encoding='utf-8') as file:
         return [json.loads(line) for line in file]
 
+def read_trajectory(file_path):
+    """
+    Read a WebShop trajectory log and return its page records, each with the
+    session goal under 'goal'.
+
+    Version 1 logs (no 'v' field) repeat the goal in every record. Version 2
+    logs start with a header record ({"v": 2, "type": "session", "goal": ...})
+    and their page records omit the goal.
+    """
+    goal = None
+    records = []
+    for record in read_jsonl(file_path):
+        version = record.get('v', 1)
+        if version == 1:
+            records.append(record)
+        elif version == 2:
+            if record.get('type') == 'session':
+                goal = record.get('goal')
+            else:
+                record.setdefault('goal', goal)
+                records.append(record)
+        else:
+            raise ValueError(f"Unsupported trajectory log version {version} in {file_path}")
+    return records
+
 def initialize_database(db_path):
     """Initialize the SQLite database with a flat sessions table."""
     conn = sqlite3.connect(db_path)
@@ -152,7 +177,7 @@ def process_sessions(session_details, observer_logs_dir, portkey_data, conn):
             session[f'count_page_{page}'] = 0
         
         if os.path.exists(log_file_path):
-            log_contents = read_jsonl(log_file_path)
+            log_contents = read_trajectory(log_file_path)
             
             # Find matching Portkey data
             portkey_info = [entry for entry in portkey_data if entry['TRACE ID'] == trace_id]
@@ -1,8 +1,13 @@
 import os
+import sys
 import zipfile
 import pandas as pd
 import shutil
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'main_app'))
+
+from web_agent_site.segment_log import SEGMENT_PREFIX, export_sessions
+
 def extract_and_process_zip_files(zip_folder, observer_logs_folder, zip_file_order):
     # Create observer_logs_folder if it doesn't exist
     if not os.path.exists(observer_logs_folder):
@@ -32,6 +37,9 @@ def extract_and_process_zip_files(zip_folder, observer_logs_folder, zip_file_ord
                 # Extract all files to the temporary folder
                 zip_ref.extractall(temp_extract_folder)
                 
+                # Segmented logs (TRAJECTORY_LOG_BACKEND=segments) of this zip
+                segments_folder = os.path.join(temp_extract_folder, 'segments', os.path.splitext(zip_filename)[0])
+
                 # Process each file in the extracted folder
                 for file in zip_ref.namelist():
                     file_path = os.path.join(temp_extract_folder, file)
@@ -49,6 +57,14 @@ def extract_and_process_zip_files(zip_folder, observer_logs_folder, zip_file_ord
                         # Rename and move observer_termination_cause files
                         new_filename = f"{os.path.splitext(zip_filename)[0]}.observer_termination_cause"
                         shutil.move(file_path, os.path.join(observer_logs_folder, new_filename))
+
+                    elif file.startswith(SEGMENT_PREFIX):
+                        os.makedirs(segments_folder, exist_ok=True)
+                        shutil.move(file_path, os.path.join(segments_folder, file))
+
+                # Split segmented logs into one JSONL file per session
+                if os.path.isdir(segments_folder):
+                    export_sessions(segments_folder, observer_logs_folder)
     
     # Merge all session_details.csv dataframes
     if dataframes:
@@ -0,0 +1,219 @@
+"""
+Load test the webshop by replaying recorded agent trajectories.
+
+Reads the per-session trajectory logs (observer zips, directories of
+<session_id>.jsonl files or of log segments, or single .jsonl files) and
+replays each session's URL sequence against a running webshop, from a pool
+of `--concurrency` simulated users that wait `--think-time` seconds between
+hops. Each replay uses its own session id, `replay<k>-<original id>`, which
+keeps the original goal for fixed_<n> sessions. Reports throughput, latency
+percentiles per route and error rates.
+
+    python analytics_script/replay_load.py analytics_script/observer_zips/baseline \\
+        --base-url http://localhost:3000 --concurrency 16 --think-time 0.5
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import threading
+import time
+import zipfile
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+import requests
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'main_app'))
+
+from web_agent_site.segment_log import INDEX_SUFFIX, SEGMENT_PREFIX, SegmentLogReader
+
+
+def parse_trajectory(lines):
+    """(page, url) of each hop of a trajectory log, v1 or v2"""
+    hops = []
+    for line in lines:
+        if not line.strip():
+            continue
+        record = json.loads(line)
+        if 'url' in record and 'page' in record:
+            hops.append((record['page'], record['url']))
+    return hops
+
+
+def load_trajectories(paths):
+    """Session id -> hops, from zips, directories and .jsonl files"""
+    trajectories = dict()
+    for path in paths:
+        if zipfile.is_zipfile(path):
+            with zipfile.ZipFile(path) as zf:
+                for name in zf.namelist():
+                    if name.endswith('.jsonl'):
+                        lines = zf.read(name).decode('utf-8').splitlines()
+                        trajectories[os.path.basename(name)[:-len('.jsonl')]] = parse_trajectory(lines)
+        elif os.path.isdir(path):
+            names = sorted(os.listdir(path))
+            if any(name.startswith(SEGMENT_PREFIX) and name.endswith(INDEX_SUFFIX) for name in names):
+                reader = SegmentLogReader(path)
+                for session_id in reader.sessions():
+                    trajectories[session_id] = parse_trajectory(reader.lines(session_id))
+            trajectories.update(load_trajectories(
+                [os.path.join(path, name) for name in names if name.endswith(('.jsonl', '.zip'))]
+            ))
+        elif path.endswith('.jsonl'):
+            with open(path, encoding='utf-8') as f:
+                trajectories[os.path.basename(path)[:-len('.jsonl')]] = parse_trajectory(f)
+    return {session_id: hops for session_id, hops in trajectories.items() if hops}
+
+
+def replay_url(url, base_url, session_id, replay_session_id):
+    """`url` on `base_url`, for the replayed session id"""
+    parts = urlsplit(url)
+    segments = [replay_session_id if segment == session_id else segment for segment in parts.path.split('/')]
+    path = '/'.join(segments)
+    return base_url.rstrip('/') + path + (f'?{parts.query}' if parts.query else '')
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return float('nan')
+    return sorted_values[min(len(sorted_values) - 1, int(q / 100 * len(sorted_values)))]
+
+
+class LoadStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        # route -> latencies in seconds
+        self.latencies = defaultdict(list)
+        # route -> failed requests (status >= 400 or no response)
+        self.errors = defaultdict(int)
+        self.sessions = 0
+
+    def record(self, route, latency, ok):
+        with self._lock:
+            self.latencies[route].append(latency)
+            if not ok:
+                self.errors[route] += 1
+
+    def session_done(self):
+        with self._lock:
+            self.sessions += 1
+
+    def report(self, elapsed):
+        routes = dict()
+        for route, latencies in sorted(self.latencies.items()):
+            latencies = sorted(latencies)
+            routes[route] = dict(
+                requests=len(latencies),
+                errors=self.errors[route],
+                error_rate=self.errors[route] / len(latencies),
+                p50_ms=1000 * percentile(latencies, 50),
+                p95_ms=1000 * percentile(latencies, 95),
+                p99_ms=1000 * percentile(latencies, 99),
+                max_ms=1000 * latencies[-1],
+            )
+        total = sum(route['requests'] for route in routes.values())
+        errors = sum(route['errors'] for route in routes.values())
+        return dict(
+            elapsed_s=elapsed,
+            sessions=self.sessions,
+            requests=total,
+            throughput_rps=total / elapsed if elapsed else 0.0,
+            error_rate=errors / total if total else 0.0,
+            routes=routes,
+        )
+
+
+def wait_until_ready(base_url, timeout):
+    """Wait for the webshop's readiness probe; False on timeout"""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            if requests.get(f"{base_url.rstrip('/')}/readyz", timeout=5).status_code == 200:
+                return True
+        except requests.RequestException:
+            pass
+        time.sleep(2)
+    return False
+
+
+def replay_session(k, session_id, hops, args, stats, deadline):
+    replay_session_id = f'replay{k}-{session_id}'
+    rng = random.Random(f'{k}-{session_id}')
+    with requests.Session() as http:
+        for page, url in hops:
+            if deadline is not None and time.time() > deadline:
+                return
+            start = time.perf_counter()
+            try:
+                response = http.get(
+                    replay_url(url, args.base_url, session_id, replay_session_id),
+                    timeout=args.timeout,
+                )
+                ok = response.status_code < 400
+            except requests.RequestException:
+                ok = False
+            stats.record(page, time.perf_counter() - start, ok)
+            if args.think_time:
+                time.sleep(args.think_time * rng.uniform(1 - args.think_jitter, 1 + args.think_jitter))
+    stats.session_done()
+
+
+def print_report(report):
+    print(f"{report['sessions']} sessions, {report['requests']} requests in {report['elapsed_s']:.1f}s: "
+          f"{report['throughput_rps']:.1f} req/s, error rate {100 * report['error_rate']:.2f}%")
+    header = ['route', 'requests', 'errors', 'p50_ms', 'p95_ms', 'p99_ms', 'max_ms']
+    print(''.join(f'{column:>16}' for column in header))
+    for route, stats in report['routes'].items():
+        print(f'{route:>16}{stats["requests"]:>16}{stats["errors"]:>16}' + ''.join(
+            f'{stats[column]:>16.1f}' for column in header[3:]
+        ))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay recorded trajectories against a running webshop")
+    parser.add_argument("paths", nargs='+', help="Observer zips, directories or .jsonl trajectory logs")
+    parser.add_argument("--base-url", default="http://localhost:3000")
+    parser.add_argument("--concurrency", type=int, default=8, help="Simulated users replaying sessions at once")
+    parser.add_argument("--think-time", type=float, default=0.0, help="Seconds between the hops of a session")
+    parser.add_argument("--think-jitter", type=float, default=0.5, help="Think time varies by +/- this fraction")
+    parser.add_argument("--repeat", type=int, default=1, help="Replay every trajectory this many times")
+    parser.add_argument("--limit", type=int, default=None, help="Only replay the first N trajectories")
+    parser.add_argument("--duration", type=float, default=None, help="Stop after this many seconds")
+    parser.add_argument("--timeout", type=float, default=60.0, help="Request timeout in seconds")
+    parser.add_argument("--ready-timeout", type=float, default=600.0, help="Wait this long for /readyz")
+    parser.add_argument("--output", default=None, help="Also write the report as JSON to this file")
+    args = parser.parse_args()
+
+    trajectories = load_trajectories(args.paths)
+    session_ids = sorted(trajectories)[:args.limit]
+    if not session_ids:
+        sys.exit("No trajectories found.")
+    print(f"Loaded {len(session_ids)} trajectories, "
+          f"{sum(len(trajectories[session_id]) for session_id in session_ids)} hops")
+    if not wait_until_ready(args.base_url, args.ready_timeout):
+        sys.exit(f"{args.base_url} is not ready.")
+
+    stats = LoadStats()
+    start = time.time()
+    deadline = start + args.duration if args.duration else None
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        futures = [
+            pool.submit(replay_session, k, session_id, trajectories[session_id], args, stats, deadline)
+            for k in range(args.repeat)
+            for session_id in session_ids
+        ]
+        for future in futures:
+            future.result()
+    report = stats.report(time.time() - start)
+
+    print_report(report)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=4)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,510 @@
+"""
+Micro-benchmarks for the request hot paths: product loading, search, page
+rendering, reward scoring, color normalization and the text environment.
+
+They run on the catalog selected by DATASET_SOURCE (the 1000-item `small`
+one by default). For each benchmark the harness reports operations per
+second, per-operation latency and the peak memory allocated by one
+operation. Startup benchmarks run in a fresh interpreter and report time
+and resident memory. Every run is appended to a JSON history, and compared
+with a stored baseline to flag regressions:
+
+    python benchmarks/run_benchmarks.py                     # run all, compare to the baseline
+    python benchmarks/run_benchmarks.py search render       # only benchmarks matching these
+    python benchmarks/run_benchmarks.py --save-baseline     # make this run the baseline
+    python benchmarks/run_benchmarks.py --fail-on-regression
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+
+MAIN_APP_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, MAIN_APP_DIR)
+
+from rich import print
+
+from web_agent_site.engine.engine import (
+    SEARCH_CACHE,
+    PAGE_FRAGMENTS,
+    END_BUTTON,
+    build_search_postings,
+    get_top_n_product_from_keywords,
+    init_search_engine,
+    load_products,
+    map_action_to_html,
+)
+from web_agent_site.engine.goal import get_reward, load_goals
+from web_agent_site.engine.normalize import normalize_color
+from web_agent_site.utils import BASE_DIR, DEBUG_PROD_SIZE, DEFAULT_FILE_PATH
+
+RESULTS_DIR = os.getenv('BENCHMARK_DIR', os.path.join(BASE_DIR, '../data/benchmarks'))
+HISTORY_PATH = os.path.join(RESULTS_DIR, 'history.json')
+BASELINE_PATH = os.path.join(RESULTS_DIR, 'baseline.json')
+# slower or more memory hungry than the baseline by more than this is a regression
+REGRESSION_THRESHOLD = 0.15
+NUM_CASES = 200
+
+BENCHMARKS = []
+
+
+def benchmark(name, min_runs=20):
+    """
+    Register a benchmark. The decorated function does the setup for the
+    fixture and returns the operation to time.
+    """
+    def register(setup):
+        BENCHMARKS.append((name, setup, min_runs))
+        return setup
+    return register
+
+
+STARTUP_BENCHMARKS = []
+
+
+def startup_benchmark(name, code, runs=3):
+    """Register `code`, timed in a fresh interpreter, with the memory it adds"""
+    STARTUP_BENCHMARKS.append((name, code, runs))
+
+
+# (description, startup benchmark, the startup benchmark it replaces): the
+# time and memory saved are reported after the results
+STARTUP_SAVINGS = []
+
+
+class Fixture:
+    """Data shared by the benchmarks, loaded on first use"""
+
+    def __init__(self):
+        self._cache = dict()
+
+    def _get(self, name, load):
+        if name not in self._cache:
+            try:
+                self._cache[name] = load()
+            except Exception as e:
+                # fail every benchmark that needs it without loading it again
+                self._cache[name] = e
+        if isinstance(self._cache[name], Exception):
+            raise self._cache[name]
+        return self._cache[name]
+
+    @property
+    def products(self):
+        return self._get('products', lambda: load_products(
+            filepath=DEFAULT_FILE_PATH, num_products=DEBUG_PROD_SIZE
+        ))
+
+    @property
+    def postings(self):
+        return self._get('postings', lambda: build_search_postings(self.products[0]))
+
+    @property
+    def search_engine(self):
+        return self._get('search_engine', lambda: init_search_engine(num_products=DEBUG_PROD_SIZE))
+
+    @property
+    def goals(self):
+        all_products, _, product_prices, _ = self.products
+        return self._get('goals', lambda: load_goals(
+            DEFAULT_FILE_PATH, all_products, product_prices, num_products=DEBUG_PROD_SIZE
+        ))
+
+    @property
+    def queries(self):
+        """Searches as agents send them: the words of goal instructions"""
+        return self._get('queries', lambda: [
+            goal['instruction_text'].lower().split(' ') for goal in self.goals[:NUM_CASES]
+        ])
+
+    @property
+    def app(self):
+        def create_app():
+            from web_agent_site.app import app
+            return app
+        return self._get('app', create_app)
+
+    @property
+    def env(self):
+        def create_env():
+            from web_agent_site.envs.web_agent_text_env import SimServer, WebAgentTextEnv
+            server = SimServer(
+                'http://127.0.0.1:3000',
+                DEFAULT_FILE_PATH,
+                num_products=DEBUG_PROD_SIZE,
+                human_goals=1,
+                search_engine=self.search_engine,
+            )
+            return WebAgentTextEnv(observation_mode='text', server=server)
+        return self._get('env', create_env)
+
+    def search(self, keywords):
+        all_products, product_item_dict, _, attribute_to_asins = self.products
+        category_to_asins, query_to_asins = self.postings
+        return get_top_n_product_from_keywords(
+            keywords, self.search_engine, all_products, product_item_dict,
+            attribute_to_asins, category_to_asins, query_to_asins,
+        )
+
+
+def cycle(values):
+    """Operation argument source: the values, round robin"""
+    state = dict(i=0)
+
+    def next_value():
+        value = values[state['i'] % len(values)]
+        state['i'] += 1
+        return value
+    return next_value
+
+
+@benchmark('load_products', min_runs=3)
+def bench_load_products(fixture):
+    def op():
+        with contextlib.redirect_stdout(io.StringIO()):
+            load_products(filepath=DEFAULT_FILE_PATH, num_products=DEBUG_PROD_SIZE)
+    return op
+
+
+@benchmark('search_text')
+def bench_search_text(fixture):
+    next_query = cycle(fixture.queries)
+
+    def op():
+        SEARCH_CACHE.clear()
+        fixture.search(next_query())
+    return op
+
+
+@benchmark('search_text_cached')
+def bench_search_text_cached(fixture):
+    next_query = cycle(fixture.queries[:20])
+    return lambda: fixture.search(next_query())
+
+
+@benchmark('search_postings')
+def bench_search_postings(fixture):
+    keywords = []
+    for goal in fixture.goals[:NUM_CASES // 3]:
+        keywords += [['<c>', goal['category']], ['<q>', goal['query']], ['<a>'] + goal['attributes'][:1]]
+    next_keywords = cycle(keywords)
+
+    def op():
+        SEARCH_CACHE.clear()
+        fixture.search(next_keywords())
+    return op
+
+
+@benchmark('render_search_page')
+def bench_render_search_page(fixture):
+    _, product_item_dict, _, _ = fixture.products
+    keywords = fixture.queries[0]
+    products = list(product_item_dict.values())[:10]
+    app = fixture.app
+
+    def op():
+        with app.test_request_context():
+            map_action_to_html(
+                'search', session_id='bench', products=products, keywords=keywords,
+                page=1, total=50, instruction_text='i need a benchmark',
+            )
+    return op
+
+
+def item_page_op(fixture, cached):
+    all_products, _, _, _ = fixture.products
+    next_product = cycle(all_products[:NUM_CASES] if not cached else all_products[:10])
+    keywords = fixture.queries[0]
+    app = fixture.app
+
+    def op():
+        product = next_product()
+        with app.test_request_context():
+            if not cached:
+                PAGE_FRAGMENTS.clear()
+            map_action_to_html(
+                'click', session_id='bench', product_info=product, keywords=keywords,
+                page=1, asin=product['asin'], options=dict(), instruction_text='i need a benchmark',
+                show_attrs=False,
+            )
+    return op
+
+
+@benchmark('render_item_page')
+def bench_render_item_page(fixture):
+    return item_page_op(fixture, cached=False)
+
+
+@benchmark('render_item_page_cached')
+def bench_render_item_page_cached(fixture):
+    return item_page_op(fixture, cached=True)
+
+
+@benchmark('get_reward')
+def bench_get_reward(fixture):
+    all_products, product_item_dict, product_prices, _ = fixture.products
+    cases = []
+    for i, goal in enumerate(fixture.goals[:NUM_CASES]):
+        # alternate the goal's own product and another one
+        asin = goal['asin'] if i % 2 == 0 else all_products[i % len(all_products)]['asin']
+        cases.append((product_item_dict[asin], goal, product_prices[asin]))
+    next_case = cycle(cases)
+
+    def op():
+        purchased_product, goal, price = next_case()
+        get_reward(purchased_product, goal, price=price, options=dict(), verbose=True)
+    return op
+
+
+@benchmark('normalize_color', min_runs=1000)
+def bench_normalize_color(fixture):
+    all_products, _, _, _ = fixture.products
+    colors = [
+        value
+        for product in all_products[:NUM_CASES]
+        for name, values in product.get('options', dict()).items()
+        if 'color' in name.lower()
+        for value in values
+    ] or ['navy blue', 'Black', 'light grey', 'rose gold']
+    next_color = cycle(colors)
+    return lambda: normalize_color(next_color())
+
+
+@benchmark('env_step_search')
+def bench_env_step_search(fixture):
+    env = fixture.env
+    env.reset(session=0)
+    next_query = cycle([' '.join(query) for query in fixture.queries])
+    return lambda: env.step(f'search[{next_query()}]')
+
+
+@benchmark('env_episode', min_runs=10)
+def bench_env_episode(fixture):
+    env = fixture.env
+    next_session = cycle(list(range(NUM_CASES)))
+
+    def op():
+        env.reset(session=next_session())
+        env.step(f'search[{env.instruction_text}]')
+        products = [
+            action for action in env.get_available_actions()['clickables']
+            if action.upper() in env.server.product_item_dict
+        ]
+        if products:
+            env.step(f'click[{products[0]}]')
+            env.step(f'click[{END_BUTTON.lower()}]')
+    return op
+
+
+@benchmark('convert_html_to_text')
+def bench_convert_html_to_text(fixture):
+    env = fixture.env
+    env.reset(session=0)
+    env.step(f'search[{env.instruction_text}]')
+    html = env.state['html']
+    return lambda: env.convert_html_to_text(html, simple=True)
+
+
+startup_benchmark('import_goal', 'import web_agent_site.engine.goal')
+startup_benchmark('import_app', 'import web_agent_site.app')
+# what importing goal.py used to load, against what the first reward now loads
+startup_benchmark(
+    'spacy_full_pipeline', 'import spacy, web_agent_site.engine.goal; spacy.load("en_core_web_sm")'
+)
+startup_benchmark('spacy_reward_pipeline', 'from web_agent_site.engine.goal import get_nlp; get_nlp()')
+STARTUP_SAVINGS.append(('Lazy, trimmed spaCy pipeline', 'spacy_reward_pipeline', 'spacy_full_pipeline'))
+
+
+def measure(op, min_runs, min_time):
+    """Time `op` until it ran `min_runs` times and for `min_time` seconds"""
+    op()
+    tracemalloc.start()
+    try:
+        op()
+        alloc_peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    timings = []
+    start = time.perf_counter()
+    while len(timings) < min_runs or time.perf_counter() - start < min_time:
+        op_start = time.perf_counter()
+        op()
+        timings.append(time.perf_counter() - op_start)
+    timings.sort()
+    total = sum(timings)
+    return dict(
+        runs=len(timings),
+        ops_per_sec=len(timings) / total,
+        mean_us=1e6 * total / len(timings),
+        p50_us=1e6 * timings[len(timings) // 2],
+        p95_us=1e6 * timings[min(len(timings) - 1, int(0.95 * len(timings)))],
+        alloc_peak_kb=alloc_peak / 1024,
+    )
+
+
+STARTUP_SCRIPT = """
+import json, sys, time
+sys.path.insert(0, {main_app_dir!r})
+def rss_kb():
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1])
+rss = rss_kb()
+start = time.perf_counter()
+{code}
+print(json.dumps(dict(seconds=time.perf_counter() - start, rss_kb=rss_kb() - rss)))
+"""
+
+
+def measure_startup(code, runs):
+    """Time `code` in fresh interpreters, with the resident memory it adds"""
+    samples = []
+    script = STARTUP_SCRIPT.format(main_app_dir=MAIN_APP_DIR, code=code)
+    for _ in range(runs):
+        output = subprocess.run(
+            [sys.executable, '-c', script], capture_output=True, text=True, check=True, cwd=MAIN_APP_DIR,
+        ).stdout
+        samples.append(json.loads(output.strip().splitlines()[-1]))
+    seconds = sorted(sample['seconds'] for sample in samples)
+    return dict(
+        runs=runs,
+        ops_per_sec=1 / seconds[len(seconds) // 2],
+        mean_us=1e6 * sum(seconds) / runs,
+        p50_us=1e6 * seconds[len(seconds) // 2],
+        rss_mb=max(sample['rss_kb'] for sample in samples) / 1024,
+    )
+
+
+def compare(results, baseline, threshold=REGRESSION_THRESHOLD):
+    """Names of the results that regressed against `baseline`, with why"""
+    regressions = dict()
+    for name, result in results.items():
+        base = baseline.get(name)
+        if base is None or 'error' in result or 'error' in base:
+            continue
+        reasons = []
+        if result['ops_per_sec'] < base['ops_per_sec'] * (1 - threshold):
+            reasons.append(f"{result['ops_per_sec'] / base['ops_per_sec'] - 1:+.0%} ops/sec")
+        for key in ('alloc_peak_kb', 'rss_mb'):
+            # ignore noise on tiny amounts of memory
+            if key in result and key in base and result[key] > max(base[key] * (1 + threshold), base[key] + 64):
+                reasons.append(f"{result[key] / max(base[key], 1e-9) - 1:+.0%} {key}")
+        if reasons:
+            regressions[name] = ', '.join(reasons)
+    return regressions
+
+
+def read_json(path, default):
+    if not os.path.exists(path):
+        return default
+    with open(path) as f:
+        return json.load(f)
+
+
+def write_json(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, cwd=MAIN_APP_DIR,
+        ).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the WebShop micro-benchmarks")
+    parser.add_argument("names", nargs='*', help="Only run benchmarks whose name contains one of these")
+    parser.add_argument("--min_time", type=float, default=1.0, help="Seconds to run each benchmark for")
+    parser.add_argument("--threshold", type=float, default=REGRESSION_THRESHOLD, help="Regression tolerance")
+    parser.add_argument("--save-baseline", action='store_true', help="Store this run as the baseline")
+    parser.add_argument("--fail-on-regression", action='store_true', help="Exit with status 1 on regressions")
+    parser.add_argument("--no-history", action='store_true', help="Do not append this run to the history")
+    args = parser.parse_args()
+
+    def selected(name):
+        return not args.names or any(pattern in name for pattern in args.names)
+
+    fixture = Fixture()
+    results = dict()
+    for name, setup, min_runs in BENCHMARKS:
+        if not selected(name):
+            continue
+        try:
+            results[name] = measure(setup(fixture), min_runs, args.min_time)
+        except ImportError as e:
+            # e.g. the text environment's gym/torch dependencies
+            results[name] = dict(error=f'skipped: {e}')
+        except Exception as e:
+            # e.g. a missing spaCy model, search index or snapshot
+            results[name] = dict(error=f'failed: {type(e).__name__}: {e}')
+    for name, code, runs in STARTUP_BENCHMARKS:
+        if not selected(name):
+            continue
+        try:
+            results[name] = measure_startup(code, runs)
+        except subprocess.CalledProcessError as e:
+            results[name] = dict(error=f'failed: {e.stderr.strip().splitlines()[-1] if e.stderr else e}')
+        except Exception as e:
+            results[name] = dict(error=f'failed: {type(e).__name__}: {e}')
+
+    baseline = read_json(BASELINE_PATH, dict()).get('results', dict())
+    regressions = compare(results, baseline, args.threshold)
+
+    print(f'{"benchmark":<24}{"ops/sec":>11}{"mean us":>10}{"p95 us":>10}{"alloc KB":>9}{"RSS MB":>7}  change')
+    for name, result in results.items():
+        if 'error' in result:
+            print(f'{name:<24}[yellow]{result["error"]}[/yellow]')
+            continue
+        base = baseline.get(name)
+        change = f'{result["ops_per_sec"] / base["ops_per_sec"] - 1:+.1%}' if base and 'ops_per_sec' in base else ''
+        if name in regressions:
+            change = f'[red]REGRESSION {regressions[name]}[/red]'
+        print(
+            f'{name:<24}{result["ops_per_sec"]:>11.1f}{result["mean_us"]:>10.1f}'
+            f'{result.get("p95_us", float("nan")):>10.1f}{result.get("alloc_peak_kb", float("nan")):>9.1f}'
+            f'{result.get("rss_mb", float("nan")):>7.1f}  {change}'
+        )
+    for description, name, replaced in STARTUP_SAVINGS:
+        result, reference = results.get(name), results.get(replaced)
+        if result and reference and 'error' not in result and 'error' not in reference:
+            print(
+                f'{description}: {(reference["p50_us"] - result["p50_us"]) / 1e6:.2f}s, '
+                f'{reference["rss_mb"] - result["rss_mb"]:.1f} MB saved'
+            )
+
+    run = dict(
+        timestamp=time.strftime('%Y-%m-%dT%H:%M:%S'),
+        commit=git_commit(),
+        python=platform.python_version(),
+        dataset=os.path.basename(DEFAULT_FILE_PATH),
+        results=results,
+        regressions=regressions,
+    )
+    if not args.no_history:
+        history = read_json(HISTORY_PATH, [])
+        history.append(run)
+        write_json(HISTORY_PATH, history)
+    if args.save_baseline:
+        write_json(BASELINE_PATH, run)
+        print(f'Saved baseline to {BASELINE_PATH}')
+    if regressions and args.fail_on_regression:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
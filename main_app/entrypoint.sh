@@ -78,12 +78,25 @@ if [ "$dataset_state_change" = true ]; then
   # Change back to the previous directory
   cd ..
 
-  # Build search engine index
+fi
+
+# Compile the catalog snapshot, prices, goals, attribute index and search
+# documents in one pass, then rebuild the search indexes. Skipped when the
+# manifest shows every artifact is up to date with the raw data files.
+if python -m web_agent_site.compile_dataset --check && [ -d search_engine/indexes ]; then
+  echo "[INFO]: Compiled dataset is up to date."
+else
+  python -m web_agent_site.compile_dataset --workers 0 || exit 1
   cd search_engine
-  python convert_product_file_format.py # convert items.json => required doc format
   ./run_indexing.sh
   cd ..
+fi
 
+# SERVER_MODE=production serves with pre-forked gunicorn workers sharing the
+# preloaded catalog (see gunicorn.conf.py); otherwise the Flask dev server.
+if [ "${SERVER_MODE:-development}" = "production" ]; then
+  export WEBSHOP_LOG=1 WEBSHOP_ATTRS=1
+  exec gunicorn -c gunicorn.conf.py web_agent_site.wsgi:application
 fi
 
 export FLASK_ENV=development
@@ -0,0 +1,72 @@
+# Production serving of the WebShop app:
+#
+#   gunicorn -c gunicorn.conf.py web_agent_site.wsgi:application
+#
+# The app is preloaded in the master, so the catalog, goals (with the noun
+# tokens the rewards compare) and search matrices are loaded once and shared
+# copy-on-write by the pre-forked workers. The data is loaded once the port is bound, and the master answers
+# /healthz and /readyz until the workers take over. Each worker logs its
+# memory use: RSS counts the shared pages too, while the private figure is
+# what the worker costs on top of the master.
+import gc
+import multiprocessing
+import os
+import random
+
+from web_agent_site.metrics import memory_usage
+
+bind = os.getenv('GUNICORN_BIND', '0.0.0.0:3000')
+# more than one worker needs a session store shared between processes
+# (SESSION_STORE=sqlite, the default then) and the segmented trajectory logs,
+# which keep the records of a session served by several workers in order
+# (TRAJECTORY_LOG_BACKEND=segments)
+workers = int(os.getenv('WEB_CONCURRENCY', '1'))
+worker_class = 'gthread'
+threads = int(os.getenv('GUNICORN_THREADS', str(min(8, 2 * multiprocessing.cpu_count()))))
+keepalive = int(os.getenv('GUNICORN_KEEPALIVE', '75'))
+timeout = int(os.getenv('GUNICORN_TIMEOUT', '120'))
+# also makes configure() (which clears the session store) run once, in the master
+preload_app = True
+accesslog = os.getenv('GUNICORN_ACCESSLOG')
+
+# log worker memory every N requests (0: only at start and exit)
+MEMORY_REPORT_EVERY = int(os.getenv('MEMORY_REPORT_EVERY', '1000'))
+
+
+def when_ready(server):
+    from web_agent_site.wsgi import preload
+    # the listeners are bound already; workers are only forked once this returns
+    preload(server.LISTENERS)
+    # objects loaded so far are never freed: keep the collector from
+    # touching (and so un-sharing) their pages in the workers
+    gc.collect()
+    gc.freeze()
+    server.log.info(f'Master memory after preload: {memory_usage()}')
+
+
+def post_fork(server, worker):
+    # workers would otherwise hand out the same "random" goals
+    random.seed()
+    from web_agent_site.app import load_data
+    # loads what could not be shared across fork (e.g. the Lucene JVM)
+    load_data()
+
+
+def post_worker_init(worker):
+    worker.requests_served = 0
+    worker.log.info(f'Worker {worker.pid} memory at start: {memory_usage()}')
+
+
+def post_request(worker, req, environ, resp):
+    worker.requests_served += 1
+    if MEMORY_REPORT_EVERY and worker.requests_served % MEMORY_REPORT_EVERY == 0:
+        worker.log.info(
+            f'Worker {worker.pid} memory after {worker.requests_served} requests: {memory_usage()}'
+        )
+
+
+def worker_exit(server, worker):
+    from web_agent_site import app
+    if app.trajectory_log is not None:
+        app.trajectory_log.close()
+    server.log.info(f'Worker {worker.pid} memory at exit: {memory_usage()}')
@@ -1,2 +1,3 @@
 #!/bin/bash
-python -m web_agent_site.app --log
+export WEBSHOP_LOG=1
+gunicorn -c gunicorn.conf.py web_agent_site.wsgi:application
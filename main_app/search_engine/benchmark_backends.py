@@ -0,0 +1,104 @@
+"""
+Benchmark the search backends (see web_agent_site/engine/search_backends.py)
+on the 1k, 100k and full catalogs: startup time, resident memory, query
+latency, and how much the BM25 top results overlap Lucene's.
+
+Each backend is measured in a fresh process so memory figures (which include
+the JVM heap for Lucene) are not polluted by the other backend.
+
+    python benchmark_backends.py --sizes 1k 100k all --num_queries 500
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, '../')
+
+from rich import print
+
+from web_agent_site.engine.engine import init_search_engine, SEARCH_RETURN_N
+
+SIZES = {'100': 100, '1k': 1000, '100k': 100000, 'all': None}
+RESOURCES = {'100': 'resources_100', '1k': 'resources_1k', '100k': 'resources_100k', 'all': 'resources'}
+BACKENDS = ['lucene', 'bm25']
+OVERLAP_K = 10
+
+
+def rss_mb():
+    """Current resident set size of this process"""
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1]) / 1024
+    return float('nan')
+
+
+def sample_queries(documents_path, n, words=4, seed=0):
+    """Queries made of the first words of randomly chosen documents"""
+    with open(documents_path) as f:
+        contents = [json.loads(line)['contents'] for line in f]
+    rng = random.Random(seed)
+    docs = rng.sample(contents, k=min(n, len(contents)))
+    return [' '.join(doc.split()[:words]) for doc in docs]
+
+
+def run_backend(backend, num_products, queries):
+    rss_before = rss_mb()
+    start = time.perf_counter()
+    search_engine = init_search_engine(num_products=num_products, backend=backend)
+    init_time = time.perf_counter() - start
+
+    latencies = []
+    top_docids = []
+    for query in queries:
+        start = time.perf_counter()
+        hits = search_engine.search(query, k=SEARCH_RETURN_N)
+        latencies.append(time.perf_counter() - start)
+        top_docids.append([hit.docid for hit in hits[:OVERLAP_K]])
+    latencies_ms = sorted(1000 * t for t in latencies)
+    stats = dict(
+        init_s=init_time,
+        rss_mb=rss_mb() - rss_before,
+        p50_ms=statistics.median(latencies_ms),
+        p95_ms=latencies_ms[int(0.95 * (len(latencies_ms) - 1))],
+        qps=len(latencies) / sum(latencies),
+    )
+    return stats, top_docids
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the Lucene and BM25 search backends")
+    parser.add_argument("--sizes", nargs='+', choices=list(SIZES), default=['1k', '100k', 'all'])
+    parser.add_argument("--backends", nargs='+', choices=BACKENDS, default=BACKENDS)
+    parser.add_argument("--num_queries", type=int, default=500, help="Queries sampled from the documents")
+    args = parser.parse_args()
+
+    ctx = multiprocessing.get_context('spawn')
+    for size in args.sizes:
+        documents_path = os.path.join(RESOURCES[size], 'documents.jsonl')
+        if not os.path.exists(documents_path):
+            print(f'[yellow]Skipping {size}: {documents_path} is missing[/yellow]')
+            continue
+        queries = sample_queries(documents_path, args.num_queries)
+        print(f'[bold]{size} catalog[/bold] ({len(queries)} queries)')
+        results = dict()
+        for backend in args.backends:
+            with ctx.Pool(1) as pool:
+                stats, top_docids = pool.apply(run_backend, (backend, SIZES[size], queries))
+            results[backend] = top_docids
+            print(f'  {backend:>6}: ' + ', '.join(f'{key}={value:.2f}' for key, value in stats.items()))
+        if len(results) == 2:
+            overlaps = [
+                len(set(a) & set(b)) / max(len(a), len(b), 1)
+                for a, b in zip(*results.values())
+            ]
+            print(f'  top-{OVERLAP_K} overlap: {statistics.mean(overlaps):.3f}')
+
+
+if __name__ == '__main__':
+    main()
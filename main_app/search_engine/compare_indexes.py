@@ -0,0 +1,93 @@
+"""
+Compare the on-disk size and search latency of two sets of Lucene indexes,
+e.g. the original (`full` profile) indexes against the `slim` ones:
+
+    INDEX_PROFILE=full python -m web_agent_site.compile_dataset   # from main_app/
+    INDEX_PROFILE=full INDEX_SUFFIX=_full ./run_indexing.sh
+    python -m web_agent_site.compile_dataset                      # from main_app/
+    ./run_indexing.sh
+    python compare_indexes.py --baseline-suffix _full
+
+Each index is measured in a fresh process, so JVM startup and class loading
+are not charged to whichever index runs first. Open time and first query
+latency approximate a cold start; run after dropping the page cache
+(`echo 3 > /proc/sys/vm/drop_caches`) to measure truly cold reads.
+"""
+import argparse
+import multiprocessing
+import os
+import statistics
+import time
+
+from pyserini.search.lucene import LuceneSearcher
+from rich import print
+
+from benchmark_backends import sample_queries
+
+INDEX_SIZES = ['_100', '', '_1k', '_100k']
+SEARCH_RETURN_N = 50
+
+
+def dir_size(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            total += os.path.getsize(os.path.join(root, name))
+    return total
+
+
+def measure(index_path, queries):
+    start = time.perf_counter()
+    searcher = LuceneSearcher(index_path)
+    open_time = time.perf_counter() - start
+
+    latencies = []
+    for query in queries:
+        start = time.perf_counter()
+        searcher.search(query, k=SEARCH_RETURN_N)
+        latencies.append(time.perf_counter() - start)
+    latencies_ms = sorted(1000 * t for t in latencies)
+    return dict(
+        size_mb=dir_size(index_path) / 2 ** 20,
+        open_ms=1000 * open_time,
+        first_ms=1000 * latencies[0],
+        p50_ms=statistics.median(latencies_ms),
+        p95_ms=latencies_ms[int(0.95 * (len(latencies_ms) - 1))],
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare index size and search latency")
+    parser.add_argument("--baseline-suffix", default="_full", help="Suffix of the baseline index directories")
+    parser.add_argument("--candidate-suffix", default="", help="Suffix of the candidate index directories")
+    parser.add_argument("--queries", default=None, help="File with one query per line")
+    parser.add_argument("--num_queries", type=int, default=200, help="Queries sampled from the documents")
+    args = parser.parse_args()
+
+    if args.queries is not None:
+        with open(args.queries) as f:
+            queries = [line.strip() for line in f if line.strip()]
+    else:
+        queries = None
+
+    ctx = multiprocessing.get_context('spawn')
+    for size in INDEX_SIZES:
+        baseline = f'indexes{size}{args.baseline_suffix}'
+        candidate = f'indexes{size}{args.candidate_suffix}'
+        if not (os.path.isdir(baseline) and os.path.isdir(candidate)):
+            print(f'[yellow]Skipping indexes{size}: {baseline} or {candidate} is missing[/yellow]')
+            continue
+        size_queries = queries or sample_queries(f'resources{size}/documents.jsonl', args.num_queries)
+        print(f'[bold]indexes{size}[/bold] ({len(size_queries)} queries)')
+        results = dict()
+        for name in (baseline, candidate):
+            with ctx.Pool(1) as pool:
+                results[name] = pool.apply(measure, (name, size_queries))
+        for key in results[baseline]:
+            before, after = results[baseline][key], results[candidate][key]
+            ratio = after / before if before else float('nan')
+            print(f'  {key:>8}: {before:10.2f} -> {after:10.2f} ({ratio:.2f}x)')
+
+
+if __name__ == '__main__':
+    main()
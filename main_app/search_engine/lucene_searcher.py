@@ -7,9 +7,11 @@ searcher = LuceneSearcher('indexes')
 hits = searcher.search('rubber sole shoes', k=20)
 
 for hit in hits:
-    doc = searcher.doc(hit.docid)
-    print(doc)
-    obj = json.loads(doc.raw())['product']['Title']
-    print(obj)
+    print(hit.docid, hit.score)
+    # only indexes built with INDEX_PROFILE=full store the raw product
+    raw = searcher.doc(hit.docid).raw()
+    if raw:
+        obj = json.loads(raw)['product']['Title']
+        print(obj)
 
 print(len(hits))
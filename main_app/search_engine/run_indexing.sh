@@ -1,31 +1,33 @@
-python -m pyserini.index.lucene \
-  --collection JsonCollection \
-  --input resources_100 \
-  --index indexes_100 \
-  --generator DefaultLuceneDocumentGenerator \
-  --threads 1 \
-  --storePositions --storeDocvectors --storeRaw
+# Index profile:
+#   slim (default) - only the document id and the positions-free postings of
+#                    `contents` are kept; enough for BM25 search, which is all
+#                    the site needs
+#   full           - additionally stores the raw documents, document vectors
+#                    and positions (the original, several times larger format)
+# INDEX_SUFFIX is appended to the index directory names, e.g. to build a full
+# profile copy next to the slim indexes for compare_indexes.py.
+profile=${INDEX_PROFILE:-slim}
+suffix=${INDEX_SUFFIX:-}
 
-python -m pyserini.index.lucene \
-  --collection JsonCollection \
-  --input resources \
-  --index indexes \
-  --generator DefaultLuceneDocumentGenerator \
-  --threads 1 \
-  --storePositions --storeDocvectors --storeRaw
+case "$profile" in
+  "slim")
+    store_flags=""
+    ;;
+  "full")
+    store_flags="--storePositions --storeDocvectors --storeRaw"
+    ;;
+  *)
+    echo "[ERROR]: Invalid INDEX_PROFILE value"
+    exit 1
+    ;;
+esac
 
-python -m pyserini.index.lucene \
-  --collection JsonCollection \
-  --input resources_1k \
-  --index indexes_1k \
-  --generator DefaultLuceneDocumentGenerator \
-  --threads 1 \
-  --storePositions --storeDocvectors --storeRaw
-
-python -m pyserini.index.lucene \
-  --collection JsonCollection \
-  --input resources_100k \
-  --index indexes_100k \
-  --generator DefaultLuceneDocumentGenerator \
-  --threads 1 \
-  --storePositions --storeDocvectors --storeRaw
+for size in _100 "" _1k _100k; do
+  python -m pyserini.index.lucene \
+    --collection JsonCollection \
+    --input resources${size} \
+    --index indexes${size}${suffix} \
+    --generator DefaultLuceneDocumentGenerator \
+    --threads 1 \
+    $store_flags || exit 1
+done
@@ -1,9 +1,12 @@
-import argparse, json, logging, random
+import argparse, os, random, secrets, threading, time
 from pathlib import Path
 from ast import literal_eval
 
 from flask import (
     Flask,
+    Response,
+    g,
+    jsonify,
     request,
     redirect,
     url_for
@@ -17,13 +20,31 @@ from web_agent_site.engine.engine import (
     convert_web_app_string_to_var,
     get_top_n_product_from_keywords,
     get_product_per_page,
+    build_search_postings,
     map_action_to_html,
-    END_BUTTON
+    search_cache_stats,
+    END_BUTTON,
+    PAGE_FRAGMENTS,
+    PAGE_TEMPLATES,
+    TEMPLATES,
 )
-from web_agent_site.engine.goal import get_reward, get_goals
+from web_agent_site.engine.goal import get_reward, load_goals
+from web_agent_site.engine.search_backends import SEARCH_BACKEND
+from web_agent_site.metrics import (
+    REGISTRY,
+    REQUEST_LATENCY,
+    SEARCH_LATENCY,
+    RENDER_LATENCY,
+    REWARD_LATENCY,
+    SESSIONS_STARTED,
+    SESSIONS_DONE,
+    memory_usage,
+)
+from web_agent_site.profiling import PROFILER
+from web_agent_site.sessions import SESSION_STORE, create_session_store
+from web_agent_site.trajectory_log import create_trajectory_log
 from web_agent_site.utils import (
     generate_mturk_code,
-    setup_logger,
     DEFAULT_FILE_PATH,
     DEBUG_PROD_SIZE,
 )
@@ -35,12 +56,301 @@ all_products = None
 product_item_dict = None
 product_prices = None
 attribute_to_asins = None
+category_to_asins = None
+query_to_asins = None
 goals = None
 weights = None
 
-user_sessions = dict()
+user_sessions = create_session_store()
 user_log_dir = None
+trajectory_log = None
 SHOW_ATTRS_TAB = False
+# required by the /admin endpoints when set, otherwise they only answer local requests
+ADMIN_TOKEN = os.getenv('ADMIN_TOKEN')
+
+LOAD_STAGES = ['products', 'goals', 'search_engine']
+load_lock = threading.Lock()
+load_status = dict(
+    ready=False,
+    stage=None,
+    completed_stages=[],
+    started_at=None,
+    finished_at=None,
+    error=None,
+    catalog_memory_mb=None,
+)
+
+
+def load_data(before_fork=False):
+    """
+    Load products, the search engine and goals once. Safe to call from
+    several threads: later callers block until the first load finished.
+
+    With `before_fork`, only what can be shared with forked workers is
+    loaded; a JVM (Lucene search backend) does not survive fork(), so that
+    stage is left for each worker's own `load_data()` call.
+    """
+    global all_products, product_item_dict, \
+           product_prices, attribute_to_asins, \
+           category_to_asins, query_to_asins, \
+           search_engine, \
+           goals, weights
+
+    with load_lock:
+        if load_status['ready']:
+            return
+        if load_status['started_at'] is None:
+            load_status['started_at'] = time.time()
+        load_status['error'] = None
+        completed = load_status['completed_stages']
+        try:
+            if 'products' not in completed:
+                load_status['stage'] = 'products'
+                memory_before = memory_usage()
+                all_products, product_item_dict, product_prices, attribute_to_asins = \
+                    load_products(
+                        filepath=DEFAULT_FILE_PATH,
+                        num_products=DEBUG_PROD_SIZE
+                    )
+                category_to_asins, query_to_asins = build_search_postings(all_products)
+                memory_after = memory_usage()
+                if memory_before is not None and memory_after is not None:
+                    load_status['catalog_memory_mb'] = round(memory_after['rss_mb'] - memory_before['rss_mb'], 1)
+                completed.append('products')
+
+            if 'goals' not in completed:
+                load_status['stage'] = 'goals'
+                goals = load_goals(
+                    DEFAULT_FILE_PATH,
+                    all_products,
+                    product_prices,
+                    num_products=DEBUG_PROD_SIZE,
+                )
+                random.seed(233)
+                random.shuffle(goals)
+                weights = [goal['weight'] for goal in goals]
+                TEMPLATES.preload(PAGE_TEMPLATES, app.jinja_env)
+                completed.append('goals')
+
+            if 'search_engine' not in completed:
+                if before_fork and SEARCH_BACKEND == 'lucene':
+                    load_status['stage'] = None
+                    return
+                load_status['stage'] = 'search_engine'
+                search_engine = init_search_engine(num_products=DEBUG_PROD_SIZE)
+                completed.append('search_engine')
+        except Exception as e:
+            load_status['error'] = f'{type(e).__name__}: {e}'
+            raise
+        load_status.update(ready=True, stage=None, finished_at=time.time())
+        print(f'WebShop data loaded in {load_status["finished_at"] - load_status["started_at"]:.1f}s')
+
+
+def configure(log=False, attrs=False):
+    """Apply the command line / WSGI server options"""
+    global user_log_dir, trajectory_log, SHOW_ATTRS_TAB
+    # called once per server run (in the gunicorn master, before forking):
+    # sessions of a previous run would otherwise be resumed by a new run's
+    # fixed_<n> ids without a new trajectory log
+    user_sessions.clear()
+    # nor should a previous run's profiler switch turn profiling on
+    PROFILER.reset_shared_state()
+    if log:
+        user_log_dir = Path('user_session_logs/mturk')
+        user_log_dir.mkdir(parents=True, exist_ok=True)
+        trajectory_log = create_trajectory_log(user_log_dir)
+    SHOW_ATTRS_TAB = attrs
+
+
+def log_trajectory(session_id, record):
+    """Queue a record for the session's trajectory log, if logging is on"""
+    if trajectory_log is not None:
+        trajectory_log.write(session_id, record)
+
+
+def start_background_load():
+    """Start loading the data at startup instead of on the first request"""
+    thread = threading.Thread(target=load_data, name='webshop-load', daemon=True)
+    thread.start()
+    return thread
+
+
+def load_progress():
+    progress = dict(load_status, stages=LOAD_STAGES)
+    if progress['started_at'] is not None:
+        end = progress['finished_at'] or time.time()
+        progress['elapsed'] = round(end - progress['started_at'], 3)
+    return progress
+
+
+@app.route('/healthz')
+def healthz():
+    """Liveness: the server is up, whether or not the data is loaded"""
+    return jsonify(dict(status='ok', **load_progress())), 200
+
+
+@app.route('/readyz')
+def readyz():
+    """Readiness: 200 once sessions can be served, 503 while loading"""
+    progress = load_progress()
+    if progress['ready']:
+        return jsonify(dict(status='ready', **progress)), 200
+    status = 'error' if progress['error'] else 'loading'
+    return jsonify(dict(status=status, **progress)), 503
+
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+    if PROFILER.should_profile(request.headers):
+        g.profile = PROFILER.start(request.endpoint or 'unmatched', request.full_path.rstrip('?'))
+
+
+@app.teardown_request
+def observe_request_latency(exc):
+    profile = g.pop('profile', None)
+    if profile is not None:
+        PROFILER.stop(profile)
+    start = g.pop('request_start', None)
+    if start is not None:
+        REQUEST_LATENCY.observe(time.perf_counter() - start, request.endpoint or 'unmatched')
+
+
+@REGISTRY.collector
+def collect_app_metrics():
+    search_cache = search_cache_stats()
+    yield ('webshop_search_cache_hits_total', 'counter', 'Search cache hits.', (), {(): search_cache['hits']})
+    yield ('webshop_search_cache_misses_total', 'counter', 'Search cache misses.', (), {(): search_cache['misses']})
+    yield ('webshop_search_cache_hit_ratio', 'gauge', 'Search cache hit rate.', (), {(): search_cache['hit_rate']})
+    yield ('webshop_search_cache_entries', 'gauge', 'Cached searches.', (), {(): search_cache['size']})
+
+    fragments = PAGE_FRAGMENTS.stats()
+    template = ('template',)
+    yield ('webshop_fragment_cache_hits_total', 'counter', 'Rendered page cache hits, per template.', template,
+           {(name,): stats['hits'] for name, stats in fragments.items()})
+    yield ('webshop_fragment_cache_misses_total', 'counter', 'Rendered page cache misses, per template.', template,
+           {(name,): stats['misses'] for name, stats in fragments.items()})
+    yield ('webshop_fragment_cache_hit_ratio', 'gauge', 'Rendered page cache hit rate, per template.', template,
+           {(name,): stats['hit_rate'] for name, stats in fragments.items()})
+    yield ('webshop_fragment_cache_entries', 'gauge', 'Cached rendered pages.', (), {(): len(PAGE_FRAGMENTS.cache)})
+
+    renders = TEMPLATES.render_stats()
+    yield ('webshop_template_renders_total', 'counter', 'Template renders, per template.', template,
+           {(name,): stats['renders'] for name, stats in renders.items()})
+    yield ('webshop_template_render_seconds_total', 'counter', 'Time spent rendering, per template.', template,
+           {(name,): stats['seconds'] for name, stats in renders.items()})
+    yield ('webshop_template_render_max_seconds', 'gauge', 'Slowest render, per template.', template,
+           {(name,): stats['max_seconds'] for name, stats in renders.items()})
+
+    yield ('webshop_sessions', 'gauge', 'Live sessions in the session store.', ('store',),
+           {(SESSION_STORE,): len(user_sessions)})
+
+    yield ('webshop_ready', 'gauge', 'Whether the data is loaded and sessions can be served.', (),
+           {(): int(load_status['ready'])})
+    progress = load_progress()
+    if progress.get('elapsed') is not None:
+        yield ('webshop_load_duration_seconds', 'gauge', 'Time spent loading the data.', (),
+               {(): progress['elapsed']})
+    if all_products is not None:
+        yield ('webshop_catalog_products', 'gauge', 'Products in the catalog.', (), {(): len(all_products)})
+    if load_status['catalog_memory_mb'] is not None:
+        yield ('webshop_catalog_memory_bytes', 'gauge', 'Resident memory added by loading the catalog.', (),
+               {(): int(load_status['catalog_memory_mb'] * 1024 * 1024)})
+    memory = memory_usage()
+    if memory is not None:
+        yield ('webshop_process_memory_bytes', 'gauge', 'Memory of this process (rss, pss, private).', ('kind',),
+               {(kind[:-len('_mb')],): int(mb * 1024 * 1024) for kind, mb in memory.items()})
+
+
+@app.route('/metrics')
+def metrics():
+    """Metrics in the Prometheus text exposition format"""
+    return Response(REGISTRY.expose(), mimetype='text/plain; version=0.0.4')
+
+
+def admin_allowed():
+    """
+    Whether the request may use the /admin endpoints: with ADMIN_TOKEN set,
+    requests sending it as X-Admin-Token; otherwise only local requests
+    (from inside the container, as the docker host connects through the
+    bridge network)
+    """
+    if ADMIN_TOKEN:
+        return secrets.compare_digest(request.headers.get('X-Admin-Token', ''), ADMIN_TOKEN)
+    return request.remote_addr in ('127.0.0.1', '::1')
+
+
+@app.route('/admin/profile', methods=['GET', 'POST', 'DELETE'])
+def admin_profile():
+    """
+    Request profiler status. POST {"enabled": true, "rate": 0.05,
+    "interval": 0.005} to switch it on (or off) and tune it, DELETE to drop
+    the profiles collected so far. From outside the container, set
+    ADMIN_TOKEN (WEBSHOP_ADMIN_TOKEN in docker-compose.yaml's .env) and send
+    it as X-Admin-Token.
+    """
+    if not admin_allowed():
+        return jsonify(error='forbidden'), 403
+    if request.method == 'POST':
+        params = request.get_json(silent=True) or request.form
+        enabled = params.get('enabled', True)
+        if isinstance(enabled, str):
+            enabled = enabled.lower() in ('1', 'true', 'on', 'yes')
+        try:
+            PROFILER.configure(
+                enabled=bool(enabled),
+                rate=float(params['rate']) if 'rate' in params else None,
+                interval=float(params['interval']) if 'interval' in params else None,
+            )
+        except (TypeError, ValueError) as e:
+            return jsonify(error=str(e)), 400
+    elif request.method == 'DELETE':
+        PROFILER.reset()
+    return jsonify(PROFILER.status())
+
+
+@app.route('/admin/profile/stacks')
+def admin_profile_stacks():
+    """
+    Collapsed stacks for flame graphs: of one kept request (?request_id=),
+    one route (?route=) or all routes, merged across the gunicorn workers.
+    Needs X-Admin-Token like /admin/profile.
+    """
+    if not admin_allowed():
+        return jsonify(error='forbidden'), 403
+    route = request.args.get('route')
+    request_id = request.args.get('request_id')
+    collapsed = PROFILER.collapsed(route=route, request_id=request_id)
+    if collapsed is None:
+        return jsonify(error='no such profile'), 404
+    name = f'request-{request_id}' if request_id is not None else route or 'all'
+    return Response(
+        collapsed,
+        mimetype='text/plain',
+        headers={'Content-Disposition': f'attachment; filename=webshop-profile-{name}.folded'},
+    )
+
+
+def render_page(action, **kwargs):
+    """`map_action_to_html`, timed per route"""
+    with RENDER_LATENCY.time(request.endpoint):
+        return map_action_to_html(action, **kwargs)
+
+
+def get_session(session_id):
+    """
+    The session of a page after the start page. A fixed_<n> session that
+    expired from the store (SESSION_TTL, SESSION_MAX) is re-created with its
+    goal, continuing its trajectory log; None for other unknown sessions.
+    """
+    session = user_sessions.get(session_id)
+    if session is None and 'fixed' in session_id:
+        goal = goals[int(session_id.split('_')[-1])]
+        session = {'goal': goal, 'done': False}
+        user_sessions[session_id] = session
+        print(f'Session {session_id} was not found, resumed with its fixed goal.')
+    return session
+
 
 @app.route('/')
 def home():
@@ -48,39 +358,31 @@ def home():
 
 @app.route('/<session_id>', methods=['GET', 'POST'])
 def index(session_id):
-    global user_log_dir
-    global all_products, product_item_dict, \
-           product_prices, attribute_to_asins, \
-           search_engine, \
-           goals, weights, user_sessions
+    global user_sessions
 
-    if search_engine is None:
-        all_products, product_item_dict, product_prices, attribute_to_asins = \
-            load_products(
-                filepath=DEFAULT_FILE_PATH,
-                num_products=DEBUG_PROD_SIZE
-            )
-        search_engine = init_search_engine(num_products=DEBUG_PROD_SIZE)
-        goals = get_goals(all_products, product_prices)
-        random.seed(233)
-        random.shuffle(goals)
-        weights = [goal['weight'] for goal in goals]
+    if not load_status['ready']:
+        load_data()
 
-    if session_id not in user_sessions and 'fixed' in session_id:
+    session = user_sessions.get(session_id)
+    if session is None and 'fixed' in session_id:
         goal_dix = int(session_id.split('_')[-1])
         goal = goals[goal_dix]
         instruction_text = goal['instruction_text']
-        user_sessions[session_id] = {'goal': goal, 'done': False}
-        if user_log_dir is not None:
-            setup_logger(session_id, user_log_dir)
-    elif session_id not in user_sessions:
+        session = {'goal': goal, 'done': False}
+        user_sessions[session_id] = session
+        SESSIONS_STARTED.inc()
+        if trajectory_log is not None:
+            trajectory_log.open_session(session_id, goal)
+    elif session is None:
         goal = random.choices(goals, weights)[0]
         instruction_text = goal['instruction_text']
-        user_sessions[session_id] = {'goal': goal, 'done': False}
-        if user_log_dir is not None:
-            setup_logger(session_id, user_log_dir)
+        session = {'goal': goal, 'done': False}
+        user_sessions[session_id] = session
+        SESSIONS_STARTED.inc()
+        if trajectory_log is not None:
+            trajectory_log.open_session(session_id, goal)
     else:
-        instruction_text = user_sessions[session_id]['goal']['instruction_text']
+        instruction_text = session['goal']['instruction_text']
 
     if request.method == 'POST' and 'search_query' in request.form:
         keywords = request.form['search_query'].lower().split(' ')
@@ -90,14 +392,11 @@ def index(session_id):
             keywords=keywords,
             page=1,
         ))
-    if user_log_dir is not None:
-        logger = logging.getLogger(session_id)
-        logger.info(json.dumps(dict(
-            page='index',
-            url=request.url,
-            goal=user_sessions[session_id]['goal'],
-        )))
-    return map_action_to_html(
+    log_trajectory(session_id, dict(
+        page='index',
+        url=request.url,
+    ))
+    return render_page(
         'start',
         session_id=session_id,
         instruction_text=instruction_text,
@@ -109,18 +408,25 @@ def index(session_id):
     methods=['GET', 'POST']
 )
 def search_results(session_id, keywords, page):
-    instruction_text = user_sessions[session_id]['goal']['instruction_text']
+    session = get_session(session_id)
+    if session is None:
+        return redirect(url_for('index', session_id=session_id))
+    goal = session['goal']
+    instruction_text = goal['instruction_text']
     page = convert_web_app_string_to_var('page', page)
     keywords = convert_web_app_string_to_var('keywords', keywords)
-    top_n_products = get_top_n_product_from_keywords(
-        keywords,
-        search_engine,
-        all_products,
-        product_item_dict,
-        attribute_to_asins,
-    )
+    with SEARCH_LATENCY.time():
+        top_n_products = get_top_n_product_from_keywords(
+            keywords,
+            search_engine,
+            all_products,
+            product_item_dict,
+            attribute_to_asins,
+            category_to_asins,
+            query_to_asins,
+        )
     products = get_product_per_page(top_n_products, page)
-    html = map_action_to_html(
+    html = render_page(
         'search',
         session_id=session_id,
         products=products,
@@ -129,17 +435,15 @@ def search_results(session_id, keywords, page):
         total=len(top_n_products),
         instruction_text=instruction_text,
     )
-    logger = logging.getLogger(session_id)
-    logger.info(json.dumps(dict(
+    log_trajectory(session_id, dict(
         page='search_results',
         url=request.url,
-        goal=user_sessions[session_id]['goal'],
         content=dict(
             keywords=keywords,
             search_result_asins=[p['asin'] for p in products],
             page=page,
         )
-    )))
+    ))
     return html
 
 
@@ -151,10 +455,13 @@ def item_page(session_id, asin, keywords, page, options):
     options = literal_eval(options)
     product_info = product_item_dict[asin]
 
-    goal_instruction = user_sessions[session_id]['goal']['instruction_text']
-    product_info['goal_instruction'] = goal_instruction
+    session = get_session(session_id)
+    if session is None:
+        return redirect(url_for('index', session_id=session_id))
+    goal = session['goal']
+    goal_instruction = goal['instruction_text']
 
-    html = map_action_to_html(
+    html = render_page(
         'click',
         session_id=session_id,
         product_info=product_info,
@@ -165,18 +472,16 @@ def item_page(session_id, asin, keywords, page, options):
         instruction_text=goal_instruction,
         show_attrs=SHOW_ATTRS_TAB,
     )
-    logger = logging.getLogger(session_id)
-    logger.info(json.dumps(dict(
+    log_trajectory(session_id, dict(
         page='item_page',
         url=request.url,
-        goal=user_sessions[session_id]['goal'],
         content=dict(
             keywords=keywords,
             page=page,
             asin=asin,
             options=options,
         )
-    )))
+    ))
     return html
 
 
@@ -188,10 +493,13 @@ def item_sub_page(session_id, asin, keywords, page, sub_page, options):
     options = literal_eval(options)
     product_info = product_item_dict[asin]
 
-    goal_instruction = user_sessions[session_id]['goal']['instruction_text']
-    product_info['goal_instruction'] = goal_instruction
+    session = get_session(session_id)
+    if session is None:
+        return redirect(url_for('index', session_id=session_id))
+    goal = session['goal']
+    goal_instruction = goal['instruction_text']
 
-    html = map_action_to_html(
+    html = render_page(
         f'click[{sub_page}]',
         session_id=session_id,
         product_info=product_info,
@@ -201,44 +509,46 @@ def item_sub_page(session_id, asin, keywords, page, sub_page, options):
         options=options,
         instruction_text=goal_instruction
     )
-    logger = logging.getLogger(session_id)
-    logger.info(json.dumps(dict(
+    log_trajectory(session_id, dict(
         page='item_sub_page',
         url=request.url,
-        goal=user_sessions[session_id]['goal'],
         content=dict(
             keywords=keywords,
             page=page,
             asin=asin,
             options=options,
         )
-    )))
+    ))
     return html
 
 
 @app.route('/done/<session_id>/<asin>/<options>', methods=['GET', 'POST'])
 def done(session_id, asin, options):
     options = literal_eval(options)
-    goal = user_sessions[session_id]['goal']
+    session = get_session(session_id)
+    if session is None:
+        return redirect(url_for('index', session_id=session_id))
+    goal = session['goal']
     purchased_product = product_item_dict[asin]
     price = product_prices[asin]
 
-    reward, reward_info = get_reward(
-        purchased_product,
-        goal,
-        price=price,
-        options=options,
-        verbose=True
-    )
-    user_sessions[session_id]['done'] = True
-    user_sessions[session_id]['reward'] = reward
-    print(user_sessions)
+    with REWARD_LATENCY.time():
+        reward, reward_info = get_reward(
+            purchased_product,
+            goal,
+            price=price,
+            options=options,
+            verbose=True
+        )
+    session['done'] = True
+    session['reward'] = reward
+    user_sessions[session_id] = session
+    SESSIONS_DONE.inc()
+    print(f'Session {session_id} done with reward {reward}')
 
-    logger = logging.getLogger(session_id)
-    logger.info(json.dumps(dict(
+    log_trajectory(session_id, dict(
         page='done',
         url=request.url,
-        goal=goal,
         content=dict(
             asin=asin,
             options=options,
@@ -246,10 +556,11 @@ def done(session_id, asin, options):
         ),
         reward=reward,
         reward_info=reward_info,
-    )))
-    del logging.root.manager.loggerDict[session_id]
+    ))
+    if trajectory_log is not None:
+        trajectory_log.close_session(session_id)
     
-    return map_action_to_html(
+    return render_page(
         f'click[{END_BUTTON}]',
         session_id=session_id,
         reward=reward,
@@ -259,7 +570,7 @@ def done(session_id, asin, options):
         query=purchased_product['query'],
         category=purchased_product['category'],
         product_category=purchased_product['product_category'],
-        goal_attrs=user_sessions[session_id]['goal']['attributes'],
+        goal_attrs=goal['attributes'],
         purchased_attrs=purchased_product['Attributes'],
         goal=goal,
         mturk_code=generate_mturk_code(session_id),
@@ -272,9 +583,7 @@ if __name__ == "__main__":
     parser.add_argument("--attrs", action='store_true', help="Show attributes tab in item page")
 
     args = parser.parse_args()
-    if args.log:
-        user_log_dir = Path('user_session_logs/mturk')
-        user_log_dir.mkdir(parents=True, exist_ok=True)
-    SHOW_ATTRS_TAB = args.attrs
+    configure(log=args.log, attrs=args.attrs)
 
+    start_background_load()
     app.run(host='0.0.0.0', port=3000)
@@ -0,0 +1,254 @@
+"""
+Single-pass dataset compiler.
+
+Reads the raw product, attribute and human instruction files once and emits
+every artifact the site needs at runtime:
+
+* the normalized catalog, prices table and attribute index (binary snapshot
+  plus its lazily loaded field store),
+* the goals list (a second snapshot section),
+* the noun tokens of the product and goal names, which the type reward
+  compares (JSONL next to the snapshot),
+* the `documents.jsonl` inputs of the four Lucene indexes. The `slim` index
+  profile only writes the document id and the searchable `contents`; `full`
+  also embeds the whole product, as the original indexes did.
+
+A manifest of input/output content hashes lets `entrypoint.sh` skip the
+compilation (and re-indexing) when nothing changed:
+
+    python -m web_agent_site.compile_dataset --check || python -m web_agent_site.compile_dataset
+"""
+import argparse
+import hashlib
+import json
+import os
+import sys
+from contextlib import ExitStack
+from os.path import join
+
+from rich import print
+
+from web_agent_site.engine.engine import (
+    iter_normalized_products,
+    build_attribute_index,
+    generate_product_prices,
+)
+from web_agent_site.engine.goal import build_noun_tokens, get_goals
+from web_agent_site.engine.product_store import LazyFieldStore
+from web_agent_site.engine.snapshot import (
+    SNAPSHOT_VERSION,
+    field_store_path,
+    noun_tokens_path,
+    snapshot_key,
+    write_snapshot,
+)
+from web_agent_site.utils import (
+    BASE_DIR,
+    DEFAULT_FILE_PATH,
+    DEFAULT_ATTR_PATH,
+    HUMAN_ATTR_PATH,
+    DEFAULT_SNAPSHOT_PATH,
+    DEFAULT_MANIFEST_PATH,
+    DEBUG_PROD_SIZE,
+)
+
+MANIFEST_VERSION = 1
+SEARCH_ENGINE_DIR = join(BASE_DIR, '../search_engine')
+INDEX_PROFILES = ('slim', 'full')
+DEFAULT_INDEX_PROFILE = os.getenv('INDEX_PROFILE', 'slim')
+
+# (documents file, number of products it holds; None for the whole catalog)
+DOCUMENT_OUTPUTS = [
+    (join(SEARCH_ENGINE_DIR, 'resources_100/documents.jsonl'), 100),
+    (join(SEARCH_ENGINE_DIR, 'resources/documents.jsonl'), None),
+    (join(SEARCH_ENGINE_DIR, 'resources_1k/documents.jsonl'), 1000),
+    (join(SEARCH_ENGINE_DIR, 'resources_100k/documents.jsonl'), 100000),
+]
+
+
+def product_to_document(p, index_profile=DEFAULT_INDEX_PROFILE):
+    """Lucene JsonCollection document for a normalized product"""
+    option_texts = []
+    options = p.get('options', {})
+    for option_name, option_contents in options.items():
+        option_contents_text = ', '.join(option_contents)
+        option_texts.append(f'{option_name}: {option_contents_text}')
+    option_text = ', and '.join(option_texts)
+
+    doc = dict()
+    doc['id'] = p['asin']
+    doc['contents'] = ' '.join([
+        p['Title'],
+        p['Description'],
+        p['BulletPoints'][0],
+        option_text,
+    ]).lower()
+    if index_profile == 'full':
+        doc['product'] = dict(p)
+    return doc
+
+
+def file_digest(path, chunk_size=1 << 20):
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def describe_file(path, previous=None):
+    """
+    Size, mtime and sha256 of `path`. The hash recorded in `previous` is
+    reused when size and mtime did not change, so checking an unchanged
+    multi-GB input does not re-read it.
+    """
+    path = os.path.abspath(path)
+    if not os.path.exists(path):
+        return None
+    stat = os.stat(path)
+    if (
+        previous is not None and
+        previous['size'] == stat.st_size and
+        previous['mtime_ns'] == stat.st_mtime_ns
+    ):
+        return previous
+    return dict(size=stat.st_size, mtime_ns=stat.st_mtime_ns, sha256=file_digest(path))
+
+
+def input_paths(filepath):
+    return [os.path.abspath(p) for p in (filepath, DEFAULT_ATTR_PATH, HUMAN_ATTR_PATH)]
+
+
+def output_paths(snapshot_path):
+    paths = [snapshot_path, field_store_path(snapshot_path), noun_tokens_path(snapshot_path)]
+    paths += [path for path, _ in DOCUMENT_OUTPUTS]
+    return [os.path.abspath(p) for p in paths]
+
+
+def manifest_params(num_products, human_goals, index_profile):
+    return dict(
+        manifest_version=MANIFEST_VERSION,
+        snapshot_version=SNAPSHOT_VERSION,
+        num_products=num_products,
+        human_goals=bool(human_goals),
+        index_profile=index_profile,
+    )
+
+
+def read_manifest(manifest_path):
+    if not os.path.exists(manifest_path):
+        return None
+    with open(manifest_path) as f:
+        return json.load(f)
+
+
+def is_up_to_date(filepath, num_products, human_goals, snapshot_path, manifest_path,
+                  index_profile=DEFAULT_INDEX_PROFILE):
+    """True when inputs hash to what the manifest recorded and outputs are untouched"""
+    manifest = read_manifest(manifest_path)
+    params = manifest_params(num_products, human_goals, index_profile)
+    if manifest is None or manifest['params'] != params:
+        return False
+    if sorted(manifest['inputs']) != sorted(input_paths(filepath)):
+        return False
+    for path, recorded in manifest['inputs'].items():
+        current = describe_file(path, recorded)
+        if current is None or current['sha256'] != recorded['sha256']:
+            return False
+    if sorted(manifest['outputs']) != sorted(output_paths(snapshot_path)):
+        return False
+    for path, recorded in manifest['outputs'].items():
+        current = describe_file(path, recorded)
+        if current is None or current['sha256'] != recorded['sha256']:
+            return False
+    return True
+
+
+def write_manifest(manifest_path, filepath, num_products, human_goals, snapshot_path,
+                   index_profile=DEFAULT_INDEX_PROFILE):
+    manifest = dict(
+        params=manifest_params(num_products, human_goals, index_profile),
+        inputs={path: describe_file(path) for path in input_paths(filepath)},
+        outputs={path: describe_file(path) for path in output_paths(snapshot_path)},
+    )
+    tmp_path = f'{manifest_path}.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, manifest_path)
+
+
+def compile_dataset(filepath=DEFAULT_FILE_PATH, num_products=None, human_goals=True,
+                    snapshot_path=DEFAULT_SNAPSHOT_PATH, manifest_path=DEFAULT_MANIFEST_PATH,
+                    num_workers=None, index_profile=DEFAULT_INDEX_PROFILE):
+    field_store = LazyFieldStore.create(field_store_path(snapshot_path))
+    all_products = []
+    with ExitStack() as stack:
+        outputs = []
+        for path, limit in DOCUMENT_OUTPUTS:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            outputs.append((stack.enter_context(open(path, 'w')), limit))
+        products = iter_normalized_products(
+            filepath, num_products, human_goals, field_store, num_workers
+        )
+        for i, p in enumerate(products):
+            all_products.append(p)
+            line = json.dumps(product_to_document(p, index_profile)) + '\n'
+            for f, limit in outputs:
+                if limit is None or i < limit:
+                    f.write(line)
+    print(f'{len(all_products)} products compiled, search documents written.')
+
+    attribute_to_asins = build_attribute_index(all_products)
+    product_prices = generate_product_prices(all_products)
+    goals = get_goals(all_products, product_prices, human_goals)
+    print(f'{len(goals)} goals compiled.')
+    build_noun_tokens(
+        [p['name'] for p in all_products] + [goal['name'] for goal in goals],
+        noun_tokens_path(snapshot_path),
+        num_workers,
+    )
+
+    sources, params = snapshot_key(filepath, num_products, human_goals)
+    write_snapshot(
+        snapshot_path,
+        dict(
+            catalog=(all_products, product_prices, attribute_to_asins),
+            goals=goals,
+        ),
+        sources,
+        params,
+    )
+    print(f'Snapshot written to {snapshot_path}.')
+    write_manifest(manifest_path, filepath, num_products, human_goals, snapshot_path, index_profile)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compile every WebShop runtime artifact in one pass")
+    parser.add_argument("--filepath", default=DEFAULT_FILE_PATH, help="Raw items_shuffle JSON file")
+    parser.add_argument("--snapshot", default=DEFAULT_SNAPSHOT_PATH, help="Catalog snapshot to write")
+    parser.add_argument("--manifest", default=DEFAULT_MANIFEST_PATH, help="Manifest of content hashes")
+    parser.add_argument("--num_products", type=int, default=DEBUG_PROD_SIZE, help="Only keep the first N products")
+    parser.add_argument("--synthetic_goals", action='store_true', help="Compile synthetic instead of human goals")
+    parser.add_argument("--workers", type=int, default=None, help="Normalization and noun parsing processes (0: all cores)")
+    parser.add_argument("--index-profile", choices=INDEX_PROFILES, default=DEFAULT_INDEX_PROFILE,
+                        help="Search documents to write (slim: id and contents only)")
+    parser.add_argument("--check", action='store_true', help="Exit with 0 if outputs are up to date, 1 otherwise")
+    args = parser.parse_args(argv)
+
+    human_goals = not args.synthetic_goals
+    if args.check:
+        fresh = is_up_to_date(
+            args.filepath, args.num_products, human_goals,
+            args.snapshot, args.manifest, args.index_profile,
+        )
+        print('Compiled dataset is up to date.' if fresh else 'Compiled dataset is missing or stale.')
+        return 0 if fresh else 1
+    compile_dataset(
+        args.filepath, args.num_products, human_goals,
+        args.snapshot, args.manifest, args.workers, args.index_profile,
+    )
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
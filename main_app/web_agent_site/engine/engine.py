@@ -4,30 +4,64 @@ import os
 import re
 import json
 import random
-from collections import defaultdict
+import itertools
+import multiprocessing
+from collections import defaultdict, deque
 from ast import literal_eval
 from decimal import Decimal
 
 import cleantext
 from tqdm import tqdm
 from rank_bm25 import BM25Okapi
-from flask import render_template_string
 from rich import print
-from pyserini.search.lucene import LuceneSearcher
 
 from web_agent_site.utils import (
     BASE_DIR,
     DEFAULT_FILE_PATH,
     DEFAULT_REVIEW_PATH,
     DEFAULT_ATTR_PATH,
+    DEFAULT_SNAPSHOT_PATH,
     HUMAN_ATTR_PATH
 )
+from web_agent_site.cache import LRUCache
+from web_agent_site.engine.product_store import LazyFieldStore, ProductRecord
+from web_agent_site.engine.rendering import TemplateRegistry, FragmentCache
+from web_agent_site.engine.search_backends import SEARCH_BACKEND, LuceneBackend, BM25Backend
+from web_agent_site.engine.snapshot import read_snapshot, snapshot_key
 
 TEMPLATE_DIR = os.path.join(BASE_DIR, 'templates')
 
 SEARCH_RETURN_N = 50
 PRODUCT_WINDOW = 10
 TOP_K_ATTR = 10
+JSON_READ_CHUNK = 1 << 20
+NORMALIZE_CHUNK = 256
+
+# worker processes for the product normalization pass (1: serial, 0: all cores)
+LOAD_PRODUCTS_WORKERS = int(os.getenv('LOAD_PRODUCTS_WORKERS', '1'))
+
+# search results cache (0 entries: disabled, TTL in seconds, 0: no expiry)
+SEARCH_CACHE_SIZE = int(os.getenv('SEARCH_CACHE_SIZE', '4096'))
+SEARCH_CACHE_TTL = float(os.getenv('SEARCH_CACHE_TTL', '0')) or None
+SEARCH_CACHE = LRUCache(SEARCH_CACHE_SIZE, ttl=SEARCH_CACHE_TTL)
+
+# raw product keys that are never used by the site
+UNUSED_PRODUCT_KEYS = (
+    'product_information',
+    'brand',
+    'brand_url',
+    'list_price',
+    'availability_quantity',
+    'availability_status',
+    'total_reviews',
+    'total_answered_questions',
+    'seller_id',
+    'seller_name',
+    'fulfilled_by_amazon',
+    'fast_track_message',
+    'aplus_present',
+    'small_description_old',
+)
 
 END_BUTTON = 'Buy Now'
 NEXT_PAGE = 'Next >'
@@ -41,19 +75,27 @@ ACTION_TO_TEMPLATE = {
     'Attributes': 'attributes_page.html',
 }
 
+PAGE_TEMPLATES = [
+    'search_page.html',
+    'results_page.html',
+    'item_page.html',
+    'done_page.html',
+    *ACTION_TO_TEMPLATE.values(),
+]
+TEMPLATES = TemplateRegistry(TEMPLATE_DIR)
+PAGE_FRAGMENTS = FragmentCache(TEMPLATES)
+
 def map_action_to_html(action, **kwargs):
     action_name, action_arg = parse_action(action)
     if action_name == 'start':
-        path = os.path.join(TEMPLATE_DIR, 'search_page.html')
-        html = render_template_string(
-            read_html_template(path=path),
+        html = TEMPLATES.render(
+            'search_page.html',
             session_id=kwargs['session_id'],
             instruction_text=kwargs['instruction_text'],
         )
     elif action_name == 'search':
-        path = os.path.join(TEMPLATE_DIR, 'results_page.html')
-        html = render_template_string(
-            read_html_template(path=path),
+        html = TEMPLATES.render(
+            'results_page.html',
             session_id=kwargs['session_id'],
             products=kwargs['products'],
             keywords=kwargs['keywords'],
@@ -62,9 +104,8 @@ def map_action_to_html(action, **kwargs):
             instruction_text=kwargs['instruction_text'],
         )
     elif action_name == 'click' and action_arg == END_BUTTON:
-        path = os.path.join(TEMPLATE_DIR, 'done_page.html')
-        html = render_template_string(
-            read_html_template(path),
+        html = TEMPLATES.render(
+            'done_page.html',
             session_id=kwargs['session_id'],
             reward=kwargs['reward'],
             asin=kwargs['asin'],
@@ -79,9 +120,9 @@ def map_action_to_html(action, **kwargs):
             product_category=kwargs.get('product_category'),
         )
     elif action_name == 'click' and action_arg in ACTION_TO_TEMPLATE:
-        path = os.path.join(TEMPLATE_DIR, ACTION_TO_TEMPLATE[action_arg])
-        html = render_template_string(
-            read_html_template(path),
+        html = PAGE_FRAGMENTS.render(
+            ACTION_TO_TEMPLATE[action_arg],
+            key=(kwargs['asin'], options_key(kwargs['options'])),
             session_id=kwargs['session_id'],
             product_info=kwargs['product_info'],
             keywords=kwargs['keywords'],
@@ -91,9 +132,9 @@ def map_action_to_html(action, **kwargs):
             instruction_text=kwargs.get('instruction_text')
         )
     elif action_name == 'click':
-        path = os.path.join(TEMPLATE_DIR, 'item_page.html')
-        html = render_template_string(
-            read_html_template(path),
+        html = PAGE_FRAGMENTS.render(
+            'item_page.html',
+            key=(kwargs['asin'], options_key(kwargs['options']), kwargs['show_attrs']),
             session_id=kwargs['session_id'],
             product_info=kwargs['product_info'],
             keywords=kwargs['keywords'],
@@ -108,10 +149,9 @@ def map_action_to_html(action, **kwargs):
     return html
 
 
-def read_html_template(path):
-    with open(path) as f:
-        template = f.read()
-    return template
+def options_key(options):
+    """Hashable form of selected options; order matters as it shows in URLs"""
+    return tuple(options.items())
 
 
 def parse_action(action):
@@ -151,24 +191,84 @@ def get_top_n_product_from_keywords(
         all_products,
         product_item_dict,
         attribute_to_asins=None,
+        category_to_asins=None,
+        query_to_asins=None,
     ):
+    """
+    Products for a search. Besides free-text search, keywords starting with
+    <r> (random), <a> (attribute), <c> (category) and <q> (query) select
+    products directly; the latter three are answered from the postings built
+    by `build_attribute_index`/`build_search_postings` when given, and by a
+    scan over `all_products` otherwise.
+
+    Results of everything but <r> searches are kept in `SEARCH_CACHE`, so
+    paginating or going back to the results page does not search again.
+    They are keyed on the ids of the search engine and catalog, which CPython
+    reuses once an object is freed; `load_products` and `init_search_engine`
+    clear the cache so a new catalog or engine never sees stale entries.
+    """
     if keywords[0] == '<r>':
-        top_n_products = random.sample(all_products, k=SEARCH_RETURN_N)
-    elif keywords[0] == '<a>':
+        return random.sample(all_products, k=SEARCH_RETURN_N)
+    key = (id(search_engine), id(all_products)) + search_cache_key(keywords)
+    top_n_products = SEARCH_CACHE.get_or_compute(key, lambda: tuple(_search_products(
+        keywords,
+        search_engine,
+        all_products,
+        product_item_dict,
+        attribute_to_asins,
+        category_to_asins,
+        query_to_asins,
+    )))
+    return list(top_n_products)
+
+
+def search_cache_key(keywords):
+    """
+    Normalized cache key for a search. Free-text queries are case and
+    whitespace insensitive (like the Lucene analyzer); <a>/<c>/<q> lookups
+    are matched exactly.
+    """
+    if keywords[0] in ('<a>', '<c>', '<q>'):
+        return tuple(keywords)
+    return ('<text>',) + tuple(' '.join(keywords).lower().split())
+
+
+def search_cache_stats():
+    return SEARCH_CACHE.stats()
+
+
+def _search_products(
+        keywords,
+        search_engine,
+        all_products,
+        product_item_dict,
+        attribute_to_asins=None,
+        category_to_asins=None,
+        query_to_asins=None,
+    ):
+    if keywords[0] == '<a>':
         attribute = ' '.join(keywords[1:]).strip()
-        asins = attribute_to_asins[attribute]
-        top_n_products = [p for p in all_products if p['asin'] in asins]
+        asins = attribute_to_asins.get(attribute, ())
+        top_n_products = [product_item_dict[asin] for asin in asins]
     elif keywords[0] == '<c>':
         category = keywords[1].strip()
-        top_n_products = [p for p in all_products if p['category'] == category]
+        if category_to_asins is not None:
+            asins = category_to_asins.get(category, ())
+            top_n_products = [product_item_dict[asin] for asin in asins]
+        else:
+            top_n_products = [p for p in all_products if p['category'] == category]
     elif keywords[0] == '<q>':
         query = ' '.join(keywords[1:]).strip()
-        top_n_products = [p for p in all_products if p['query'] == query]
+        if query_to_asins is not None:
+            asins = query_to_asins.get(query, ())
+            top_n_products = [product_item_dict[asin] for asin in asins]
+        else:
+            top_n_products = [p for p in all_products if p['query'] == query]
     else:
         keywords = ' '.join(keywords)
         hits = search_engine.search(keywords, k=SEARCH_RETURN_N)
-        docs = [search_engine.doc(hit.docid) for hit in hits]
-        top_n_asins = [json.loads(doc.raw())['id'] for doc in docs]
+        # hit.docid is the collection's `id` field, i.e. the product ASIN
+        top_n_asins = [hit.docid for hit in hits]
         top_n_products = [product_item_dict[asin] for asin in top_n_asins if asin in product_item_dict]
     return top_n_products
 
@@ -192,48 +292,224 @@ def generate_product_prices(all_products):
     return product_prices
 
 
-def init_search_engine(num_products=None):
+def init_search_engine(num_products=None, backend=SEARCH_BACKEND):
     if num_products == 100:
-        indexes = 'indexes_100'
+        suffix = '_100'
     elif num_products == 1000:
-        indexes = 'indexes_1k'
+        suffix = '_1k'
     elif num_products == 100000:
-        indexes = 'indexes_100k'
+        suffix = '_100k'
     elif num_products is None:
-        indexes = 'indexes'
+        suffix = ''
     else:
         raise NotImplementedError(f'num_products being {num_products} is not supported yet.')
-    search_engine = LuceneSearcher(os.path.join(BASE_DIR, f'../search_engine/{indexes}'))
+    SEARCH_CACHE.clear()
+    search_dir = os.path.join(BASE_DIR, '../search_engine')
+    if backend == 'lucene':
+        search_engine = LuceneBackend(os.path.join(search_dir, f'indexes{suffix}'))
+    elif backend == 'bm25':
+        search_engine = BM25Backend.load(os.path.join(search_dir, f'resources{suffix}/documents.jsonl'))
+    else:
+        raise ValueError(f'Unknown search backend {backend!r}, expected lucene or bm25.')
     return search_engine
 
 
+def clean_product(product):
+    for key in UNUSED_PRODUCT_KEYS:
+        product.pop(key, None)
+    return product
+
+
 def clean_product_keys(products):
     for product in products:
-        product.pop('product_information', None)
-        product.pop('brand', None)
-        product.pop('brand_url', None)
-        product.pop('list_price', None)
-        product.pop('availability_quantity', None)
-        product.pop('availability_status', None)
-        product.pop('total_reviews', None)
-        product.pop('total_answered_questions', None)
-        product.pop('seller_id', None)
-        product.pop('seller_name', None)
-        product.pop('fulfilled_by_amazon', None)
-        product.pop('fast_track_message', None)
-        product.pop('aplus_present', None)
-        product.pop('small_description_old', None)
+        clean_product(product)
     print('Keys cleaned.')
     return products
 
 
-def load_products(filepath, num_products=None, human_goals=True):
-    # TODO: move to preprocessing step -> enforce single source of truth
+_JSON_ARRAY_SEPARATOR = re.compile(r'[\s,]*')
+
+
+def iter_json_array(filepath, chunk_size=JSON_READ_CHUNK):
+    """
+    Incrementally decode the elements of a top-level JSON array, so that only
+    one element (plus a read buffer) is held in memory at a time.
+    """
+    decoder = json.JSONDecoder()
     with open(filepath) as f:
-        products = json.load(f)
-    print('Products loaded.')
-    products = clean_product_keys(products)
-    
+        buffer = ''
+        while not buffer:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            buffer = chunk.lstrip()
+        if not buffer.startswith('['):
+            raise ValueError(f'{filepath} does not contain a JSON array.')
+        pos = 1
+        eof = False
+        while True:
+            pos = _JSON_ARRAY_SEPARATOR.match(buffer, pos).end()
+            if pos < len(buffer) and buffer[pos] == ']':
+                return
+            try:
+                if pos == len(buffer):
+                    raise json.JSONDecodeError('Buffer exhausted', buffer, pos)
+                element, pos = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                # element continues in the next chunk
+                if eof:
+                    raise
+                chunk = f.read(chunk_size)
+                eof = not chunk
+                buffer = buffer[pos:] + chunk
+                pos = 0
+                continue
+            yield element
+
+
+def iter_products(filepath, num_products=None):
+    """Stream raw products from `filepath` with the unused keys dropped"""
+    products = iter_json_array(filepath)
+    if num_products is not None:
+        # using item_shuffle.json, we assume products already shuffled
+        products = itertools.islice(products, num_products)
+    for product in products:
+        yield clean_product(product)
+
+
+def normalize_product(p, attributes, human_attributes=None, human_goals=True,
+                      all_reviews=None, all_ratings=None):
+    """Derive the fields used by the site/rewards from a raw (cleaned) product"""
+    asin = p['asin']
+    all_reviews = all_reviews or dict()
+    all_ratings = all_ratings or dict()
+
+    p['Title'] = p['name']
+    p['Description'] = p['full_description']
+    p['Reviews'] = all_reviews.get(asin, [])
+    p['Rating'] = all_ratings.get(asin, 'N.A.')
+    for r in p['Reviews']:
+        if 'score' not in r:
+            r['score'] = r.pop('stars')
+        if 'review' not in r:
+            r['body'] = ''
+        else:
+            r['body'] = r.pop('review')
+    p['BulletPoints'] = p['small_description'] \
+        if isinstance(p['small_description'], list) else [p['small_description']]
+
+    pricing = p.get('pricing')
+    if pricing is None or not pricing:
+        pricing = [100.0]
+        price_tag = '$100.0'
+    else:
+        pricing = [
+            float(Decimal(re.sub(r'[^\d.]', '', price)))
+            for price in pricing.split('$')[1:]
+        ]
+        if len(pricing) == 1:
+            price_tag = f"${pricing[0]}"
+        else:
+            price_tag = f"${pricing[0]} to ${pricing[1]}"
+            pricing = pricing[:2]
+    p['pricing'] = pricing
+    p['Price'] = price_tag
+
+    options = dict()
+    customization_options = p['customization_options']
+    option_to_image = dict()
+    if customization_options:
+        for option_name, option_contents in customization_options.items():
+            if option_contents is None:
+                continue
+            option_name = option_name.lower()
+
+            option_values = []
+            for option_content in option_contents:
+                option_value = option_content['value'].strip().replace('/', ' | ').lower()
+                option_image = option_content.get('image', None)
+
+                option_values.append(option_value)
+                option_to_image[option_value] = option_image
+            options[option_name] = option_values
+    p['options'] = options
+    p['option_to_image'] = option_to_image
+
+    # without color, size, price, availability
+    if asin in attributes and 'attributes' in attributes[asin]:
+        p['Attributes'] = attributes[asin]['attributes']
+    else:
+        p['Attributes'] = ['DUMMY_ATTR']
+
+    if human_goals:
+        if asin in human_attributes:
+            p['instructions'] = human_attributes[asin]
+    else:
+        p['instruction_text'] = \
+            attributes[asin].get('instruction', None)
+
+        p['instruction_attributes'] = \
+            attributes[asin].get('instruction_attributes', None)
+
+    p['MainImage'] = p['images'][0]
+    p['query'] = p['query'].lower().strip()
+    return p
+
+
+_normalize_args = None
+
+
+def _init_normalize_worker(*normalize_args):
+    global _normalize_args
+    _normalize_args = normalize_args
+
+
+def _normalize_chunk(products):
+    return [normalize_product(p, *_normalize_args) for p in products]
+
+
+def parallel_normalize_products(products, normalize_args, num_workers, chunk_size=NORMALIZE_CHUNK):
+    """
+    Run `normalize_product` over `products` in a process pool. Chunks are
+    yielded back in submission order and only a bounded number of them is in
+    flight, so the output is identical to the serial pass and the input is
+    still consumed incrementally.
+    """
+    with multiprocessing.Pool(
+        num_workers,
+        initializer=_init_normalize_worker,
+        initargs=normalize_args,
+    ) as pool:
+        pending = deque()
+        products = iter(products)
+        while True:
+            while len(pending) < 2 * num_workers:
+                chunk = list(itertools.islice(products, chunk_size))
+                if not chunk:
+                    break
+                pending.append(pool.apply_async(_normalize_chunk, (chunk,)))
+            if not pending:
+                return
+            yield from pending.popleft().get()
+
+
+def iter_normalized_products(filepath, num_products=None, human_goals=True,
+                             field_store=None, num_workers=None):
+    """
+    Stream normalized products from `filepath` as compact `ProductRecord`s,
+    skipping invalid ASINs and keeping only the first occurrence of each ASIN.
+    Heavy fields are written to `field_store` (a temporary one by default).
+
+    With `num_workers` > 1 (default: $LOAD_PRODUCTS_WORKERS, 0 for all cores)
+    the normalization is sharded across a process pool.
+    """
+    if field_store is None:
+        field_store = LazyFieldStore.create()
+    if num_workers is None:
+        num_workers = LOAD_PRODUCTS_WORKERS
+    if num_workers == 0:
+        num_workers = os.cpu_count()
+
     # with open(DEFAULT_REVIEW_PATH) as f:
     #     reviews = json.load(f)
     all_reviews = dict()
@@ -242,121 +518,88 @@ def load_products(filepath, num_products=None, human_goals=True):
     #     all_reviews[r['asin']] = r['reviews']
     #     all_ratings[r['asin']] = r['average_rating']
 
+    human_attributes = None
     if human_goals:
         with open(HUMAN_ATTR_PATH) as f:
             human_attributes = json.load(f)
     with open(DEFAULT_ATTR_PATH) as f:
         attributes = json.load(f)
-    with open(HUMAN_ATTR_PATH) as f:
-        human_attributes = json.load(f)
     print('Attributes loaded.')
 
-    asins = set()
-    all_products = []
-    attribute_to_asins = defaultdict(set)
-    if num_products is not None:
-        # using item_shuffle.json, we assume products already shuffled
-        products = products[:num_products]
-    for i, p in tqdm(enumerate(products), total=len(products)):
-        asin = p['asin']
-        if asin == 'nan' or len(asin) > 10:
-            continue
-
-        if asin in asins:
-            continue
-        else:
-            asins.add(asin)
-
-        products[i]['category'] = p['category']
-        products[i]['query'] = p['query']
-        products[i]['product_category'] = p['product_category']
-
-        products[i]['Title'] = p['name']
-        products[i]['Description'] = p['full_description']
-        products[i]['Reviews'] = all_reviews.get(asin, [])
-        products[i]['Rating'] = all_ratings.get(asin, 'N.A.')
-        for r in products[i]['Reviews']:
-            if 'score' not in r:
-                r['score'] = r.pop('stars')
-            if 'review' not in r:
-                r['body'] = ''
-            else:
-                r['body'] = r.pop('review')
-        products[i]['BulletPoints'] = p['small_description'] \
-            if isinstance(p['small_description'], list) else [p['small_description']]
-
-        pricing = p.get('pricing')
-        if pricing is None or not pricing:
-            pricing = [100.0]
-            price_tag = '$100.0'
-        else:
-            pricing = [
-                float(Decimal(re.sub(r'[^\d.]', '', price)))
-                for price in pricing.split('$')[1:]
-            ]
-            if len(pricing) == 1:
-                price_tag = f"${pricing[0]}"
-            else:
-                price_tag = f"${pricing[0]} to ${pricing[1]}"
-                pricing = pricing[:2]
-        products[i]['pricing'] = pricing
-        products[i]['Price'] = price_tag
-
-        options = dict()
-        customization_options = p['customization_options']
-        option_to_image = dict()
-        if customization_options:
-            for option_name, option_contents in customization_options.items():
-                if option_contents is None:
-                    continue
-                option_name = option_name.lower()
-
-                option_values = []
-                for option_content in option_contents:
-                    option_value = option_content['value'].strip().replace('/', ' | ').lower()
-                    option_image = option_content.get('image', None)
-
-                    option_values.append(option_value)
-                    option_to_image[option_value] = option_image
-                options[option_name] = option_values
-        products[i]['options'] = options
-        products[i]['option_to_image'] = option_to_image
-
-        # without color, size, price, availability
-        # if asin in attributes and 'attributes' in attributes[asin]:
-        #     products[i]['Attributes'] = attributes[asin]['attributes']
-        # else:
-        #     products[i]['Attributes'] = ['DUMMY_ATTR']
-        # products[i]['instruction_text'] = \
-        #     attributes[asin].get('instruction', None)
-        # products[i]['instruction_attributes'] = \
-        #     attributes[asin].get('instruction_attributes', None)
-
-        # without color, size, price, availability
-        if asin in attributes and 'attributes' in attributes[asin]:
-            products[i]['Attributes'] = attributes[asin]['attributes']
-        else:
-            products[i]['Attributes'] = ['DUMMY_ATTR']
-            
-        if human_goals:
-            if asin in human_attributes:
-                products[i]['instructions'] = human_attributes[asin]
-        else:
-            products[i]['instruction_text'] = \
-                attributes[asin].get('instruction', None)
+    def unique_products():
+        # dedup happens before sharding to keep first-occurrence semantics
+        asins = set()
+        for p in tqdm(iter_products(filepath, num_products), total=num_products):
+            asin = p['asin']
+            if asin == 'nan' or len(asin) > 10:
+                continue
 
-            products[i]['instruction_attributes'] = \
-                attributes[asin].get('instruction_attributes', None)
+            if asin in asins:
+                continue
+            else:
+                asins.add(asin)
+            yield p
 
-        products[i]['MainImage'] = p['images'][0]
-        products[i]['query'] = p['query'].lower().strip()
+    normalize_args = (attributes, human_attributes, human_goals, all_reviews, all_ratings)
+    if num_workers > 1:
+        products = parallel_normalize_products(unique_products(), normalize_args, num_workers)
+    else:
+        products = (normalize_product(p, *normalize_args) for p in unique_products())
+    for p in products:
+        yield ProductRecord.from_dict(p, field_store)
+    field_store.finalize()
 
-        all_products.append(products[i])
 
+def build_attribute_index(all_products):
+    """Attribute -> ASINs having it, in catalog order"""
+    attribute_to_asins = defaultdict(list)
     for p in all_products:
         for a in p['Attributes']:
-            attribute_to_asins[a].add(p['asin'])
+            asins = attribute_to_asins[a]
+            if not asins or asins[-1] != p['asin']:
+                asins.append(p['asin'])
+    return dict(attribute_to_asins)
+
+
+def build_search_postings(all_products):
+    """Category -> ASINs and query -> ASINs postings, in catalog order"""
+    category_to_asins = defaultdict(list)
+    query_to_asins = defaultdict(list)
+    for p in all_products:
+        category_to_asins[p['category']].append(p['asin'])
+        query_to_asins[p['query']].append(p['asin'])
+    return dict(category_to_asins), dict(query_to_asins)
+
+
+def load_products(filepath, num_products=None, human_goals=True,
+                  snapshot_path=DEFAULT_SNAPSHOT_PATH, num_workers=None):
+    """
+    Load the normalized catalog, preferring the compiled binary snapshot
+    (see `web_agent_site.engine.snapshot`) and falling back to parsing the raw
+    JSON files when the snapshot is missing or stale.
+    """
+    # results cached for an earlier catalog are keyed on ids this one may reuse
+    SEARCH_CACHE.clear()
+    sources, params = snapshot_key(filepath, num_products, human_goals)
+    catalog = read_snapshot(snapshot_path, sources, params)
+    if catalog is not None:
+        all_products, product_prices, attribute_to_asins = catalog
+        product_item_dict = {p['asin']: p for p in all_products}
+        print(f'Products loaded from snapshot {snapshot_path}.')
+        return all_products, product_item_dict, product_prices, attribute_to_asins
+    return load_products_from_json(filepath, num_products, human_goals, num_workers=num_workers)
+
+
+def load_products_from_json(filepath, num_products=None, human_goals=True,
+                            field_store_path=None, num_workers=None):
+    # TODO: move to preprocessing step -> enforce single source of truth
+    field_store = LazyFieldStore.create(field_store_path)
+    all_products = list(iter_normalized_products(
+        filepath, num_products, human_goals, field_store, num_workers
+    ))
+    print(f'{len(all_products)} products loaded.')
 
+    attribute_to_asins = build_attribute_index(all_products)
     product_item_dict = {p['asin']: p for p in all_products}
     product_prices = generate_product_prices(all_products)
     return all_products, product_item_dict, product_prices, attribute_to_asins
@@ -2,17 +2,141 @@
 Functions for specifying goals and reward calculations.
 """
 import itertools
+import json
+import os
 import random
-import spacy
+import sys
+import threading
+from importlib import metadata
 from collections import defaultdict
 from rich import print
 from thefuzz import fuzz
+from web_agent_site.cache import LRUCache
 from web_agent_site.engine.normalize import normalize_color
+from web_agent_site.engine.snapshot import noun_tokens_path, read_snapshot, snapshot_key
+from web_agent_site.utils import DEFAULT_SNAPSHOT_PATH
+
+SPACY_MODEL = 'en_core_web_sm'
+# get_type_reward only reads part-of-speech tags (tagger + attribute_ruler)
+SPACY_EXCLUDE = ['parser', 'ner', 'lemmatizer', 'senter']
+
+_nlp = None
+_nlp_lock = threading.Lock()
+
+
+def get_nlp():
+    """The spaCy pipeline for reward scoring, loaded on first use"""
+    global _nlp
+    if _nlp is None:
+        with _nlp_lock:
+            if _nlp is None:
+                import spacy
+                _nlp = spacy.load(SPACY_MODEL, exclude=SPACY_EXCLUDE)
+    return _nlp
+
+
+NOUN_POS = ('PNOUN', 'NOUN', 'PROPN')
+
+NOUN_CACHE_SIZE = int(os.getenv('NOUN_CACHE_SIZE', '10000'))
+
+# product or goal name -> its lowercased noun tokens, in order. Loaded with
+# the goals (in the gunicorn master, before the workers are forked) and only
+# read afterwards, so the workers keep sharing its pages
+NOUN_TOKENS = dict()
+# names missing from NOUN_TOKENS, parsed by this process
+PARSED_NOUN_TOKENS = LRUCache(NOUN_CACHE_SIZE)
+
+
+def parse_noun_tokens(doc):
+    return tuple(sys.intern(t.text.lower()) for t in doc if t.pos_ in NOUN_POS)
+
+
+def noun_tokens(name):
+    """Noun tokens of `name`, parsed with spaCy only when it is not cached"""
+    tokens = NOUN_TOKENS.get(name)
+    if tokens is None:
+        tokens = PARSED_NOUN_TOKENS.get_or_compute(name, lambda: parse_noun_tokens(get_nlp()(name)))
+    return tokens
+
+
+def installed_spacy_versions():
+    """Cache header matching the installed spaCy and model, read without importing them"""
+    try:
+        return dict(
+            model=SPACY_MODEL,
+            spacy_version=metadata.version('spacy'),
+            model_version=metadata.version(SPACY_MODEL),
+        )
+    except metadata.PackageNotFoundError:
+        return None
+
+
+def load_noun_tokens(path):
+    """Add the names cached at `path` by `build_noun_tokens`; returns how many"""
+    if not os.path.exists(path):
+        return 0
+    count = 0
+    with open(path) as f:
+        header = json.loads(f.readline() or '{}')
+        if header != installed_spacy_versions():
+            # tokens of another spaCy or model version: parse names again
+            print(f'Noun tokens {path} were parsed with another spaCy or model version, ignoring them.')
+            return 0
+        for line in f:
+            record = json.loads(line)
+            # interned: the names share most of their nouns
+            NOUN_TOKENS[record['name']] = tuple(sys.intern(noun) for noun in record['nouns'])
+            count += 1
+    return count
+
+
+def build_noun_tokens(names, path, num_workers=None, batch_size=256):
+    """
+    Parse the noun tokens of `names` (reusing those already cached at `path`)
+    and write them to `path` as JSONL, after a header record naming the model
+    and the spaCy and model versions.
+    `num_workers` spaCy processes parse the missing names, 0 for all cores.
+    """
+    import spacy
+
+    load_noun_tokens(path)
+    nlp = get_nlp()
+    names = list(dict.fromkeys(names))
+    missing = [name for name in names if name not in NOUN_TOKENS]
+    if missing:
+        n_process = os.cpu_count() if num_workers == 0 else (num_workers or 1)
+        docs = nlp.pipe(missing, batch_size=batch_size, n_process=n_process)
+        for name, doc in zip(missing, docs):
+            NOUN_TOKENS[name] = parse_noun_tokens(doc)
+    header = dict(model=SPACY_MODEL, spacy_version=spacy.__version__, model_version=nlp.meta['version'])
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w') as f:
+        f.write(json.dumps(header) + '\n')
+        for name in names:
+            f.write(json.dumps(dict(name=name, nouns=NOUN_TOKENS[name])) + '\n')
+    os.replace(tmp_path, path)
+    print(f'Noun tokens of {len(names)} names written to {path} ({len(missing)} parsed).')
 
-nlp = spacy.load("en_core_web_sm")
 
 PRICE_RANGE = [10.0 * i for i in range(1, 100)]
 
+def load_goals(filepath, all_products, product_prices, num_products=None,
+               human_goals=True, snapshot_path=DEFAULT_SNAPSHOT_PATH):
+    """
+    Goals compiled by `compile_dataset` if the snapshot is fresh, else
+    generated. Also loads the noun tokens cached next to the snapshot.
+    """
+    count = load_noun_tokens(noun_tokens_path(snapshot_path))
+    if count:
+        print(f'Noun tokens of {count} names loaded.')
+    sources, params = snapshot_key(filepath, num_products, human_goals)
+    goals = read_snapshot(snapshot_path, sources, params, section='goals')
+    if goals is not None:
+        print(f'{len(goals)} goals loaded from snapshot.')
+        return goals
+    return get_goals(all_products, product_prices, human_goals)
+
+
 def get_goals(all_products, product_prices, human_goals=True):
     if human_goals:
         return get_human_goals(all_products, product_prices)
@@ -140,11 +264,8 @@ def get_type_reward(purchased_product, goal):
     purchased_type = purchased_product['name']
     desired_type = goal['name']
 
-    purchased_type_parse = nlp(purchased_type)
-    desired_type_parse = nlp(desired_type)
-
-    purchased_type_parse = [t.text.lower() for t in purchased_type_parse if t.pos_ in ('PNOUN', 'NOUN', 'PROPN')]
-    desired_type_parse = [t.text.lower() for t in desired_type_parse if t.pos_ in ('PNOUN', 'NOUN', 'PROPN')]
+    purchased_type_parse = noun_tokens(purchased_type)
+    desired_type_parse = noun_tokens(desired_type)
 
     n_intersect_type = len(
         set(purchased_type_parse) & set(desired_type_parse)
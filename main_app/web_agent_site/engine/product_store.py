@@ -0,0 +1,237 @@
+"""
+Compact in-memory representation of normalized products.
+"""
+import json
+import os
+import pickle
+import sys
+import tempfile
+from collections.abc import Mapping
+
+from web_agent_site.cache import LRUCache
+
+FIELD_CACHE_SIZE = int(os.getenv('PRODUCT_FIELD_CACHE_SIZE', '1024'))
+
+
+def intern_value(value):
+    return sys.intern(value) if isinstance(value, str) else value
+
+
+class _Unset:
+    """Marker for optional product fields that were never set"""
+
+
+class LazyFieldStore:
+    """
+    On-disk store for the large product fields that only the item page and
+    its sub-pages need (description, bullet points, option images).
+
+    Each product's fields are appended as one JSON blob; records keep just the
+    blob's (offset, length) and fetch it on first access through a bounded LRU.
+    """
+    HEAVY_FIELDS = ('full_description', 'BulletPoints', 'option_to_image')
+
+    def __init__(self, file, path=None, tmp_path=None, cache_size=FIELD_CACHE_SIZE):
+        self.path = path
+        self._file = file
+        self._tmp_path = tmp_path
+        self._size = os.fstat(file.fileno()).st_size
+        self.cache = LRUCache(cache_size)
+
+    @classmethod
+    def create(cls, path=None):
+        """
+        Start a new store. Without `path` the store lives in an anonymous
+        temporary file that disappears with the process; otherwise it is
+        written next to `path` and moved into place by `finalize`.
+        """
+        if path is None:
+            return cls(tempfile.TemporaryFile(prefix='webshop_fields_'))
+        tmp_path = f'{path}.tmp'
+        return cls(open(tmp_path, 'w+b'), path=path, tmp_path=tmp_path)
+
+    @classmethod
+    def open(cls, path, size=None):
+        """Open a finalized store, checking it has the size it was saved with"""
+        f = open(path, 'rb')
+        store = cls(f, path=path)
+        if size is not None and store._size != size:
+            f.close()
+            raise ValueError(f'Field store {path} does not match its snapshot.')
+        return store
+
+    def append(self, key, fields):
+        """Write `fields` and return the (offset, length) to fetch them with"""
+        blob = json.dumps(fields, separators=(',', ':')).encode('utf-8')
+        offset = self._size
+        self._file.write(blob)
+        self._size += len(blob)
+        # products are usually consumed right after being written
+        self.cache.put(key, fields)
+        return offset, len(blob)
+
+    def finalize(self):
+        self._file.flush()
+        if self._tmp_path is not None:
+            os.replace(self._tmp_path, self.path)
+            self._tmp_path = None
+
+    def fetch(self, key, offset, length):
+        return self.cache.get_or_compute(key, lambda: self._read(offset, length))
+
+    def _read(self, offset, length):
+        if self._tmp_path is not None or self.path is None:
+            # still being written: make sure buffered writes are visible
+            self._file.flush()
+        blob = os.pread(self._file.fileno(), length, offset)
+        return json.loads(blob)
+
+    def __reduce__(self):
+        if self.path is None or self._tmp_path is not None:
+            raise pickle.PicklingError('Only finalized, file-backed field stores can be pickled.')
+        return type(self).open, (self.path, self._size)
+
+
+class ProductRecord(Mapping):
+    """
+    Slotted, read-only product record.
+
+    Behaves like the normalized product dicts it replaces (`product['Title']`,
+    `product.get('options', {})`, `'instructions' in product`, attribute access
+    from templates), but stores each field once: `Title`/`Description` are
+    aliases of `name`/`full_description`, options are kept as tuples and
+    repeated strings (categories, queries, option values, attributes) are
+    interned so they are shared across records. The large text fields live in
+    a `LazyFieldStore` and are only read from disk when accessed.
+    """
+    __slots__ = (
+        'asin',
+        'name',
+        'category',
+        'query',
+        'product_category',
+        'pricing',
+        'Price',
+        'Rating',
+        'Reviews',
+        'MainImage',
+        'Attributes',
+        '_options',
+        '_fields',
+        '_fields_offset',
+        '_fields_length',
+        'instructions',
+        'instruction_text',
+        'instruction_attributes',
+    )
+
+    KEYS = (
+        'asin',
+        'name',
+        'Title',
+        'full_description',
+        'Description',
+        'category',
+        'query',
+        'product_category',
+        'pricing',
+        'Price',
+        'Rating',
+        'Reviews',
+        'BulletPoints',
+        'MainImage',
+        'Attributes',
+        'options',
+        'option_to_image',
+        'instructions',
+        'instruction_text',
+        'instruction_attributes',
+    )
+    _KEY_SET = frozenset(KEYS)
+    OPTIONAL_KEYS = ('instructions', 'instruction_text', 'instruction_attributes')
+
+    @classmethod
+    def from_dict(cls, p, field_store):
+        """
+        Build a record from a product dict produced by `normalize_product`,
+        moving its heavy fields into `field_store`
+        """
+        record = cls()
+        record.asin = p['asin']
+        record.name = p['name']
+        record.category = intern_value(p['category'])
+        record.query = intern_value(p['query'])
+        record.product_category = intern_value(p['product_category'])
+        record.pricing = tuple(p['pricing'])
+        record.Price = intern_value(p['Price'])
+        record.Rating = intern_value(p['Rating'])
+        record.Reviews = tuple(p['Reviews'])
+        record.MainImage = p['MainImage']
+        record.Attributes = tuple(intern_value(a) for a in p['Attributes'])
+        record._options = tuple(
+            (intern_value(name), tuple(intern_value(v) for v in values))
+            for name, values in p['options'].items()
+        )
+        record._fields = field_store
+        record._fields_offset, record._fields_length = field_store.append(
+            record.asin,
+            {field: p[field] for field in field_store.HEAVY_FIELDS},
+        )
+        for key in cls.OPTIONAL_KEYS:
+            if key in p:
+                setattr(record, key, p[key])
+        return record
+
+    def _heavy_fields(self):
+        return self._fields.fetch(self.asin, self._fields_offset, self._fields_length)
+
+    @property
+    def Title(self):
+        return self.name
+
+    @property
+    def full_description(self):
+        return self._heavy_fields()['full_description']
+
+    @property
+    def Description(self):
+        return self.full_description
+
+    @property
+    def BulletPoints(self):
+        return self._heavy_fields()['BulletPoints']
+
+    @property
+    def options(self):
+        return {name: list(values) for name, values in self._options}
+
+    @property
+    def option_to_image(self):
+        return dict(self._heavy_fields()['option_to_image'])
+
+    def __getitem__(self, key):
+        if key not in self._KEY_SET:
+            raise KeyError(key)
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key) from None
+
+    def __iter__(self):
+        for key in self.KEYS:
+            if key not in self.OPTIONAL_KEYS or hasattr(self, key):
+                yield key
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __repr__(self):
+        return f'{type(self).__name__}(asin={self.asin!r}, name={self.name!r})'
+
+    def __getstate__(self):
+        return tuple(getattr(self, slot, _Unset) for slot in self.__slots__)
+
+    def __setstate__(self, state):
+        for slot, value in zip(self.__slots__, state):
+            if value is not _Unset:
+                setattr(self, slot, value)
@@ -0,0 +1,173 @@
+"""
+Compile-once registry for the page templates.
+
+`render_template_string` re-parses and re-compiles the template source on
+every call. The registry reads each template file once and compiles it once
+per Jinja environment (the Flask app's, so `url_for` and the other app
+globals keep working), then renders the cached `Template`. With
+TEMPLATE_AUTO_RELOAD=1, templates are recompiled when their file changes,
+for editing templates without restarting the server.
+
+`FragmentCache` additionally keeps whole rendered product pages, with the
+session specific values left as placeholders.
+"""
+import os
+import secrets
+import threading
+import time
+import weakref
+
+from flask import current_app, url_for
+from markupsafe import escape
+
+from web_agent_site.cache import LRUCache
+
+TEMPLATE_AUTO_RELOAD = os.getenv('TEMPLATE_AUTO_RELOAD', '0') == '1'
+FRAGMENT_CACHE_SIZE = int(os.getenv('FRAGMENT_CACHE_SIZE', '2048'))
+
+
+class TemplateRegistry:
+    def __init__(self, template_dir, auto_reload=TEMPLATE_AUTO_RELOAD):
+        self.template_dir = template_dir
+        self.auto_reload = auto_reload
+        # name -> (mtime, source)
+        self._sources = dict()
+        # jinja environment -> name -> (mtime, compiled template)
+        self._compiled = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+        # name -> [renders, total seconds, max seconds]
+        self._timings = dict()
+
+    def _mtime(self, name):
+        return os.stat(os.path.join(self.template_dir, name)).st_mtime_ns
+
+    def _source(self, name, mtime):
+        cached = self._sources.get(name)
+        if cached is not None and (mtime is None or cached[0] == mtime):
+            return cached
+        path = os.path.join(self.template_dir, name)
+        with open(path) as f:
+            source = f.read()
+        cached = (mtime if mtime is not None else self._mtime(name), source)
+        self._sources[name] = cached
+        return cached
+
+    def get(self, name, env=None):
+        """Compiled template `name` for `env` (the current app's by default)"""
+        env = env if env is not None else current_app.jinja_env
+        templates = self._compiled.get(env)
+        cached = templates.get(name) if templates is not None else None
+        mtime = self._mtime(name) if self.auto_reload else None
+        if cached is not None and (mtime is None or cached[0] == mtime):
+            return cached[1]
+        with self._lock:
+            templates = self._compiled.setdefault(env, dict())
+            source_mtime, source = self._source(name, mtime)
+            template = env.from_string(source)
+            templates[name] = (source_mtime, template)
+        return template
+
+    def preload(self, names, env=None):
+        """Compile `names` ahead of the first request"""
+        for name in names:
+            self.get(name, env)
+
+    def render(self, name, **context):
+        """Render `name` like `render_template_string` would, timing the call"""
+        start = time.perf_counter()
+        app = current_app._get_current_object()
+        template = self.get(name, app.jinja_env)
+        app.update_template_context(context)
+        html = template.render(context)
+        self._record(name, time.perf_counter() - start)
+        return html
+
+    def _record(self, name, elapsed):
+        with self._lock:
+            timing = self._timings.setdefault(name, [0, 0.0, 0.0])
+            timing[0] += 1
+            timing[1] += elapsed
+            timing[2] = max(timing[2], elapsed)
+
+    def render_stats(self):
+        """Per-template render count, total seconds and slowest render in seconds"""
+        with self._lock:
+            return {
+                name: dict(renders=count, seconds=total, max_seconds=longest)
+                for name, (count, total, longest) in self._timings.items()
+            }
+
+
+class FragmentCache:
+    """
+    Bounded cache of rendered item pages and item sub-pages.
+
+    For a product, these pages only differ between sessions by the session
+    id, search keywords and results page embedded in their URLs, and by the
+    instruction text. A page is rendered once per (template, key) with
+    placeholders for those values, which are substituted, URL-encoded and
+    escaped exactly as the template would have done, on every serve.
+    """
+    URL_FIELDS = ('session_id', 'keywords', 'page')
+    TEXT_FIELDS = ('instruction_text',)
+    # endpoint whose URL holds all of URL_FIELDS, used to encode their values
+    URL_ENDPOINT = 'search_results'
+
+    def __init__(self, registry, maxsize=FRAGMENT_CACHE_SIZE):
+        self.registry = registry
+        self.cache = LRUCache(maxsize)
+        nonce = secrets.token_hex(4)
+        self.placeholders = {
+            field: f'__frag{nonce}_{field}__'
+            for field in self.URL_FIELDS + self.TEXT_FIELDS
+        }
+        self._lock = threading.Lock()
+        # name -> [hits, misses]
+        self._counts = dict()
+
+    def render(self, name, key, **context):
+        """
+        Render template `name` for `context`, reusing the page cached under
+        `key`, which must identify every non session specific value used
+        """
+        app = current_app._get_current_object()
+        cache_key = (id(app), name) + tuple(key)
+        fragment = self.cache.get(cache_key)
+        self._count(name, fragment is not None)
+        if fragment is None:
+            fragment_context = dict(context, **self.placeholders)
+            fragment = self.registry.render(name, **fragment_context)
+            self.cache.put(cache_key, fragment)
+        for field in self.URL_FIELDS:
+            value = escape(self._url_value(field, context))
+            fragment = fragment.replace(self.placeholders[field], value)
+        for field in self.TEXT_FIELDS:
+            value = escape(context.get(field))
+            fragment = fragment.replace(self.placeholders[field], value)
+        return fragment
+
+    def _url_value(self, field, context):
+        """`context[field]` as `url_for` encodes it in this app's URLs"""
+        args = {f: self.placeholders[f] for f in self.URL_FIELDS}
+        prefix, suffix = url_for(self.URL_ENDPOINT, **args).split(self.placeholders[field])
+        args[field] = context[field]
+        url = url_for(self.URL_ENDPOINT, **args)
+        return url[len(prefix):len(url) - len(suffix)]
+
+    def _count(self, name, hit):
+        with self._lock:
+            counts = self._counts.setdefault(name, [0, 0])
+            counts[0 if hit else 1] += 1
+
+    def stats(self):
+        """Per-template hits, misses and hit rate"""
+        with self._lock:
+            return {
+                name: dict(hits=hits, misses=misses, hit_rate=hits / (hits + misses))
+                for name, (hits, misses) in self._counts.items()
+            }
+
+    def clear(self):
+        self.cache.clear()
+        with self._lock:
+            self._counts.clear()
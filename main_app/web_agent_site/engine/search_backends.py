@@ -0,0 +1,208 @@
+"""
+Pluggable search backends.
+
+A backend only has to provide `search(query, k)` returning hits, best first,
+with a `docid` (the product ASIN) and a `score`, i.e. the subset of pyserini's
+`LuceneSearcher` the site uses. Two backends are available:
+
+* `lucene` - pyserini's `LuceneSearcher` over the `search_engine/indexes*`
+  directories (needs a JVM),
+* `bm25` - a NumPy/SciPy sparse-matrix BM25 built from the same
+  `search_engine/resources*/documents.jsonl` files, with Anserini's default
+  analysis (standard tokenization, possessive removal, lower-casing, English
+  stop words, Porter stemming) and BM25 parameters (k1=0.9, b=0.4), so its
+  rankings match the Lucene path up to Lucene's lossy length encoding.
+
+The backend is picked with the SEARCH_BACKEND environment variable.
+"""
+import json
+import os
+import re
+import threading
+from collections import namedtuple
+
+import numpy as np
+from scipy import sparse
+
+from web_agent_site.cache import LRUCache
+from web_agent_site.engine.stemmer import PorterStemmer
+
+SEARCH_BACKEND = os.getenv('SEARCH_BACKEND', 'lucene')
+# distinct tokens whose stem is kept; queries bring new tokens for as long as the server runs
+STEM_CACHE_SIZE = int(os.getenv('STEM_CACHE_SIZE', '100000'))
+BM25_K1 = 0.9
+BM25_B = 0.4
+BM25_CACHE_VERSION = 1
+
+SearchHit = namedtuple('SearchHit', ['docid', 'score'])
+
+# Lucene's EnglishAnalyzer.ENGLISH_STOP_WORDS_SET
+ENGLISH_STOP_WORDS = frozenset([
+    'a', 'an', 'and', 'are', 'as', 'at', 'be', 'but', 'by', 'for', 'if', 'in',
+    'into', 'is', 'it', 'no', 'not', 'of', 'on', 'or', 'such', 'that', 'the',
+    'their', 'then', 'there', 'these', 'they', 'this', 'to', 'was', 'will',
+    'with',
+])
+# words, numbers and the in-word punctuation the standard tokenizer keeps
+TOKEN_PATTERN = re.compile(r"\d+(?:,\d+)+|\w+(?:[.'’]\w+)*")
+
+
+class SearchBackend:
+    """Interface shared by the search backends"""
+    name = None
+
+    def search(self, query, k=10):
+        """Top `k` hits for `query` as objects with `docid` and `score`"""
+        raise NotImplementedError
+
+
+class LuceneBackend(SearchBackend):
+    """Thin wrapper around pyserini's `LuceneSearcher`"""
+    name = 'lucene'
+
+    def __init__(self, index_dir):
+        # imported lazily so the bm25 backend never starts a JVM
+        from pyserini.search.lucene import LuceneSearcher
+        self.searcher = LuceneSearcher(index_dir)
+
+    def search(self, query, k=10):
+        return self.searcher.search(query, k=k)
+
+    def doc(self, docid):
+        return self.searcher.doc(docid)
+
+
+class Analyzer:
+    """Python counterpart of Anserini's `DefaultEnglishAnalyzer`"""
+    def __init__(self, stem_cache_size=STEM_CACHE_SIZE):
+        self._stemmer = PorterStemmer()
+        self._stem_cache = LRUCache(stem_cache_size)
+        # the stemmer keeps per-word state while it runs
+        self._lock = threading.Lock()
+
+    def _stem(self, token):
+        return self._stem_cache.get_or_compute(token, lambda: self._stem_locked(token))
+
+    def _stem_locked(self, token):
+        with self._lock:
+            return self._stemmer.stem(token)
+
+    def __call__(self, text):
+        terms = []
+        for token in TOKEN_PATTERN.findall(text.lower()):
+            if token.endswith(("'s", "’s")):
+                token = token[:-2]
+            if token and token not in ENGLISH_STOP_WORDS:
+                terms.append(self._stem(token))
+        return terms
+
+
+class BM25Backend(SearchBackend):
+    """
+    BM25 over a (documents x terms) CSC matrix holding each posting's
+    precomputed BM25 weight; a query sums the columns of its terms.
+    """
+    name = 'bm25'
+
+    def __init__(self, docids, vocab, weights):
+        self.docids = docids
+        self.vocab = vocab
+        self.weights = weights
+        self.term_ids = {term: i for i, term in enumerate(vocab)}
+        self.analyzer = Analyzer()
+
+    @classmethod
+    def from_documents(cls, documents_path, k1=BM25_K1, b=BM25_B):
+        analyzer = Analyzer()
+        vocab = dict()
+        docids = []
+        indptr = [0]
+        indices = []
+        counts = []
+        doc_lengths = []
+        with open(documents_path) as f:
+            for line in f:
+                doc = json.loads(line)
+                docids.append(doc['id'])
+                terms = analyzer(doc['contents'])
+                doc_lengths.append(len(terms))
+                tf = dict()
+                for term in terms:
+                    term_id = vocab.setdefault(term, len(vocab))
+                    tf[term_id] = tf.get(term_id, 0) + 1
+                indices.extend(tf.keys())
+                counts.extend(tf.values())
+                indptr.append(len(indices))
+
+        num_docs = len(docids)
+        tf = sparse.csr_matrix(
+            (np.asarray(counts, dtype=np.float32), np.asarray(indices, dtype=np.int32), indptr),
+            shape=(num_docs, len(vocab)),
+        )
+        doc_lengths = np.asarray(doc_lengths, dtype=np.float32)
+        avg_length = doc_lengths.mean() if num_docs else 1.0
+        df = np.bincount(tf.indices, minlength=len(vocab)).astype(np.float32)
+        idf = np.log1p((num_docs - df + 0.5) / (df + 0.5))
+
+        # w = idf * tf / (tf + k1 * (1 - b + b * dl / avgdl)), as in Lucene 8
+        norms = k1 * (1 - b + b * doc_lengths / avg_length)
+        row_norms = np.repeat(norms, np.diff(tf.indptr))
+        tf.data = idf[tf.indices] * tf.data / (tf.data + row_norms)
+        weights = tf.tocsc()
+
+        vocab_terms = np.empty(len(vocab), dtype=object)
+        for term, term_id in vocab.items():
+            vocab_terms[term_id] = term
+        return cls(np.asarray(docids, dtype=object), vocab_terms, weights)
+
+    @classmethod
+    def load(cls, documents_path, cache_path=None):
+        """
+        Load the BM25 matrix cached next to `documents_path`, (re)building the
+        cache when the documents changed since it was written
+        """
+        cache_path = cache_path or os.path.join(os.path.dirname(documents_path), 'bm25.npz')
+        stat = os.stat(documents_path)
+        source = np.array([BM25_CACHE_VERSION, stat.st_size, stat.st_mtime_ns], dtype=np.int64)
+        if os.path.exists(cache_path):
+            with np.load(cache_path, allow_pickle=True) as cache:
+                if np.array_equal(cache['source'], source):
+                    weights = sparse.csc_matrix(
+                        (cache['data'], cache['indices'], cache['indptr']),
+                        shape=tuple(cache['shape']),
+                    )
+                    return cls(cache['docids'], cache['vocab'], weights)
+        backend = cls.from_documents(documents_path)
+        backend.save(cache_path, source)
+        return backend
+
+    def save(self, cache_path, source):
+        tmp_path = f'{cache_path}.tmp.npz'
+        np.savez(
+            tmp_path,
+            source=source,
+            docids=self.docids,
+            vocab=self.vocab,
+            data=self.weights.data,
+            indices=self.weights.indices,
+            indptr=self.weights.indptr,
+            shape=np.asarray(self.weights.shape),
+        )
+        os.replace(tmp_path, cache_path)
+
+    def search(self, query, k=10):
+        term_ids = self.term_ids
+        ids = [term_ids[term] for term in self.analyzer(query) if term in term_ids]
+        if not ids:
+            return []
+        # repeated query terms count once per occurrence, like Lucene's clauses
+        unique_ids, query_tf = np.unique(ids, return_counts=True)
+        scores = self.weights[:, unique_ids] @ query_tf.astype(np.float32)
+        matches = np.flatnonzero(scores)
+        if len(matches) > k:
+            # keep everything tied with the k-th score so ties are cut by index
+            kth = -np.partition(-scores[matches], k - 1)[k - 1]
+            matches = matches[scores[matches] >= kth]
+        # best score first, ties broken by index order like Lucene
+        order = np.lexsort((matches, -scores[matches]))[:k]
+        return [SearchHit(self.docids[i], float(scores[i])) for i in matches[order]]
@@ -0,0 +1,128 @@
+"""
+Versioned binary snapshot of the normalized product catalog.
+
+`load_products` spends most of a cold start parsing the raw JSON files and
+re-normalizing every product. This module lets the offline compile step
+(`web_agent_site.compile_dataset`, the only way to build a snapshot) write
+the normalized result once, so later starts only have to map the snapshot
+file into memory and unpickle it.
+
+Layout: MAGIC | version (u32) | header length (u32) | header | sections...
+The header is a pickled dict holding the fingerprints of the source files the
+snapshot was built from, the load parameters, and the (offset, length) of each
+pickled section relative to the end of the header.
+"""
+import mmap
+import os
+import pickle
+import struct
+
+from rich import print
+
+from web_agent_site.utils import DEFAULT_ATTR_PATH, HUMAN_ATTR_PATH
+
+SNAPSHOT_MAGIC = b'WSCATLOG'
+SNAPSHOT_VERSION = 4
+_PREAMBLE = struct.Struct('<II')
+
+
+def source_fingerprint(paths):
+    """(path, size, mtime_ns) for every source file; missing files map to None"""
+    fingerprint = []
+    for path in paths:
+        path = os.path.abspath(path)
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            fingerprint.append((path, None, None))
+        else:
+            fingerprint.append((path, stat.st_size, stat.st_mtime_ns))
+    return fingerprint
+
+
+def snapshot_key(filepath, num_products=None, human_goals=True):
+    """Source fingerprint and load parameters a snapshot must match to be fresh"""
+    sources = source_fingerprint([filepath, DEFAULT_ATTR_PATH, HUMAN_ATTR_PATH])
+    params = dict(num_products=num_products, human_goals=bool(human_goals))
+    return sources, params
+
+
+def field_store_path(snapshot_path):
+    """Lazily loaded product fields are stored next to the snapshot"""
+    return f'{snapshot_path}.fields'
+
+
+def noun_tokens_path(snapshot_path):
+    """The noun tokens of product and goal names are cached next to the snapshot"""
+    return f'{snapshot_path}.nouns.jsonl'
+
+
+def write_snapshot(path, sections, sources, params):
+    """Atomically write pickled `sections` (name -> object) to `path`"""
+    blobs = []
+    offsets = dict()
+    offset = 0
+    for name, obj in sections.items():
+        blob = pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL)
+        offsets[name] = (offset, len(blob))
+        offset += len(blob)
+        blobs.append(blob)
+    header = pickle.dumps(dict(
+        version=SNAPSHOT_VERSION,
+        sources=sources,
+        params=params,
+        sections=offsets,
+    ), protocol=pickle.HIGHEST_PROTOCOL)
+
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(SNAPSHOT_MAGIC)
+        f.write(_PREAMBLE.pack(SNAPSHOT_VERSION, len(header)))
+        f.write(header)
+        for blob in blobs:
+            f.write(blob)
+    os.replace(tmp_path, path)
+
+
+def read_snapshot_header(mm):
+    """Return (header, payload start) or (None, None) for foreign/old files"""
+    start = len(SNAPSHOT_MAGIC)
+    if mm[:start] != SNAPSHOT_MAGIC:
+        return None, None
+    version, header_len = _PREAMBLE.unpack(mm[start:start + _PREAMBLE.size])
+    if version != SNAPSHOT_VERSION:
+        return None, None
+    start += _PREAMBLE.size
+    header = pickle.loads(mm[start:start + header_len])
+    return header, start + header_len
+
+
+def read_snapshot(path, sources, params, section='catalog'):
+    """
+    Memory-map the snapshot at `path` and unpickle `section` from it.
+
+    Returns None when the snapshot is missing, was written by another snapshot
+    version, or is stale w.r.t. `sources`/`params`.
+    """
+    if not path or not os.path.exists(path):
+        return None
+    with open(path, 'rb') as f, \
+            mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        header, payload_start = read_snapshot_header(mm)
+        if header is None:
+            print(f'Snapshot {path} has an unsupported format, ignoring it.')
+            return None
+        if header['sources'] != sources or header['params'] != params:
+            print(f'Snapshot {path} is stale, ignoring it.')
+            return None
+        if section not in header['sections']:
+            return None
+        offset, length = header['sections'][section]
+        start = payload_start + offset
+        with memoryview(mm)[start:start + length] as view:
+            try:
+                return pickle.loads(view)
+            except (OSError, ValueError) as e:
+                # e.g. the product field store next to the snapshot is gone
+                print(f'Snapshot {path} could not be loaded ({e}), ignoring it.')
+                return None
@@ -0,0 +1,184 @@
+"""
+Porter stemmer, following Martin Porter's reference C implementation (the
+same variant as Lucene's `PorterStemFilter`, which Anserini's default
+English analyzer uses), so the NumPy search backend produces the same terms
+as the Lucene indexes.
+"""
+
+
+class PorterStemmer:
+    """Not thread-safe: keeps the word being stemmed in instance state"""
+
+    def stem(self, word):
+        if len(word) <= 2:
+            return word
+        self.b = word
+        self.k = len(word) - 1
+        self.j = 0
+        self._step1ab()
+        if self.k > 0:
+            self._step1c()
+            self._step2()
+            self._step3()
+            self._step4()
+            self._step5()
+        return self.b[:self.k + 1]
+
+    def _cons(self, i):
+        ch = self.b[i]
+        if ch in 'aeiou':
+            return False
+        if ch == 'y':
+            return i == 0 or not self._cons(i - 1)
+        return True
+
+    def _m(self):
+        """Number of consonant-vowel sequences in b[0:j+1]"""
+        n = 0
+        i = 0
+        j = self.j
+        while True:
+            if i > j:
+                return n
+            if not self._cons(i):
+                break
+            i += 1
+        i += 1
+        while True:
+            while True:
+                if i > j:
+                    return n
+                if self._cons(i):
+                    break
+                i += 1
+            i += 1
+            n += 1
+            while True:
+                if i > j:
+                    return n
+                if not self._cons(i):
+                    break
+                i += 1
+            i += 1
+
+    def _vowel_in_stem(self):
+        return any(not self._cons(i) for i in range(self.j + 1))
+
+    def _doublec(self, j):
+        return j >= 1 and self.b[j] == self.b[j - 1] and self._cons(j)
+
+    def _cvc(self, i):
+        if i < 2 or not self._cons(i) or self._cons(i - 1) or not self._cons(i - 2):
+            return False
+        return self.b[i] not in 'wxy'
+
+    def _ends(self, s):
+        length = len(s)
+        if length > self.k + 1 or self.b[self.k - length + 1:self.k + 1] != s:
+            return False
+        self.j = self.k - length
+        return True
+
+    def _setto(self, s):
+        self.b = self.b[:self.j + 1] + s + self.b[self.k + 1:]
+        self.k = self.j + len(s)
+
+    def _r(self, s):
+        if self._m() > 0:
+            self._setto(s)
+
+    def _step1ab(self):
+        b = self.b
+        if b[self.k] == 's':
+            if self._ends('sses'):
+                self.k -= 2
+            elif self._ends('ies'):
+                self._setto('i')
+            elif b[self.k - 1] != 's':
+                self.k -= 1
+        if self._ends('eed'):
+            if self._m() > 0:
+                self.k -= 1
+        elif (self._ends('ed') or self._ends('ing')) and self._vowel_in_stem():
+            self.k = self.j
+            if self._ends('at'):
+                self._setto('ate')
+            elif self._ends('bl'):
+                self._setto('ble')
+            elif self._ends('iz'):
+                self._setto('ize')
+            elif self._doublec(self.k):
+                self.k -= 1
+                if self.b[self.k] in 'lsz':
+                    self.k += 1
+            elif self._m() == 1 and self._cvc(self.k):
+                self._setto('e')
+
+    def _step1c(self):
+        if self._ends('y') and self._vowel_in_stem():
+            self.b = self.b[:self.k] + 'i' + self.b[self.k + 1:]
+
+    _STEP2 = {
+        'a': (('ational', 'ate'), ('tional', 'tion')),
+        'c': (('enci', 'ence'), ('anci', 'ance')),
+        'e': (('izer', 'ize'),),
+        'l': (('bli', 'ble'), ('alli', 'al'), ('entli', 'ent'), ('eli', 'e'), ('ousli', 'ous')),
+        'o': (('ization', 'ize'), ('ation', 'ate'), ('ator', 'ate')),
+        's': (('alism', 'al'), ('iveness', 'ive'), ('fulness', 'ful'), ('ousness', 'ous')),
+        't': (('aliti', 'al'), ('iviti', 'ive'), ('biliti', 'ble')),
+        'g': (('logi', 'log'),),
+    }
+
+    _STEP3 = {
+        'e': (('icate', 'ic'), ('ative', ''), ('alize', 'al')),
+        'i': (('iciti', 'ic'),),
+        'l': (('ical', 'ic'), ('ful', '')),
+        's': (('ness', ''),),
+    }
+
+    _STEP4 = {
+        'a': ('al',),
+        'c': ('ance', 'ence'),
+        'e': ('er',),
+        'i': ('ic',),
+        'l': ('able', 'ible'),
+        'n': ('ant', 'ement', 'ment', 'ent'),
+        'o': ('ion', 'ou'),
+        's': ('ism',),
+        't': ('ate', 'iti'),
+        'u': ('ous',),
+        'v': ('ive',),
+        'z': ('ize',),
+    }
+
+    def _replace_suffix(self, rules):
+        for suffix, replacement in rules:
+            if self._ends(suffix):
+                self._r(replacement)
+                return
+
+    def _step2(self):
+        self._replace_suffix(self._STEP2.get(self.b[self.k - 1], ()))
+
+    def _step3(self):
+        self._replace_suffix(self._STEP3.get(self.b[self.k], ()))
+
+    def _step4(self):
+        for suffix in self._STEP4.get(self.b[self.k - 1], ()):
+            if self._ends(suffix):
+                if suffix == 'ion' and not (self.j >= 0 and self.b[self.j] in 'st'):
+                    continue
+                break
+        else:
+            return
+        if self._m() > 1:
+            self.k = self.j
+
+    def _step5(self):
+        self.j = self.k
+        if self.b[self.k] == 'e':
+            a = self._m()
+            if a > 1 or (a == 1 and not self._cvc(self.k - 1)):
+                self.k -= 1
+        if self.b[self.k] == 'l' and self._doublec(self.k) and self._m() > 1:
+            self.k -= 1
@@ -18,10 +18,13 @@ from web_agent_site.engine.engine import (
     map_action_to_html,
     parse_action,
     get_product_per_page,
+    build_search_postings,
     ACTION_TO_TEMPLATE,
+    PAGE_TEMPLATES,
+    TEMPLATES,
     END_BUTTON, NEXT_PAGE, PREV_PAGE, BACK_TO_SEARCH,
 )
-from web_agent_site.engine.goal import get_reward, get_goals
+from web_agent_site.engine.goal import get_reward, load_goals
 from web_agent_site.utils import (
     DEFAULT_FILE_PATH,
     FEAT_CONV,
@@ -284,6 +287,7 @@ class SimServer:
         num_products=None,
         human_goals=0,
         show_attrs=False,
+        search_engine=None,
     ):
         """
         Constructor for simulated server serving WebShop application
@@ -293,14 +297,24 @@ class SimServer:
         limit_goals (`int`) -- Limit to number of goals available
         num_products (`int`) -- Number of products to search across
         human_goals (`bool`) -- If true, load human goals; otherwise, load synthetic goals
+        search_engine -- An already initialized search engine to use instead of starting another one
         """
         # Load all products, goals, and search engine
         self.base_url = base_url
-        self.all_products, self.product_item_dict, self.product_prices, _ = \
+        self.all_products, self.product_item_dict, self.product_prices, self.attribute_to_asins = \
             load_products(filepath=file_path, num_products=num_products, human_goals=human_goals)
-        self.search_engine = init_search_engine(num_products=num_products)
-        self.goals = get_goals(self.all_products, self.product_prices, human_goals)
+        self.category_to_asins, self.query_to_asins = build_search_postings(self.all_products)
+        self.search_engine = init_search_engine(num_products=num_products) \
+            if search_engine is None else search_engine
+        self.goals = load_goals(
+            file_path,
+            self.all_products,
+            self.product_prices,
+            num_products=num_products,
+            human_goals=human_goals,
+        )
         self.show_attrs = show_attrs
+        TEMPLATES.preload(PAGE_TEMPLATES, app.jinja_env)
 
         # Fix outcome for random shuffling of goals
         random.seed(233)
@@ -365,6 +379,9 @@ class SimServer:
             self.search_engine,
             self.all_products,
             self.product_item_dict,
+            self.attribute_to_asins,
+            self.category_to_asins,
+            self.query_to_asins,
         )
         self.search_time += time.time() - old_time
         
@@ -0,0 +1,185 @@
+"""
+Metrics of the web app, served at /metrics in the Prometheus text exposition
+format (no client library needed).
+
+Histograms and counters are updated while requests are served; collectors
+registered with `REGISTRY.collector` report values read at scrape time
+(cache statistics, session counts, memory). Metrics are per process: with
+several gunicorn workers, each scrape reports the worker that served it.
+"""
+import bisect
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+# request latencies in seconds, from a fragment cache hit to a slow search
+DEFAULT_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+)
+
+
+def memory_usage():
+    """RSS, PSS and private memory of this process in MB (Linux only)"""
+    usage = dict()
+    try:
+        with open('/proc/self/smaps_rollup') as f:
+            for line in f:
+                key, _, value = line.partition(':')
+                if key in ('Rss', 'Pss', 'Private_Clean', 'Private_Dirty'):
+                    usage[key] = int(value.split()[0]) / 1024
+    except OSError:
+        return None
+    return dict(
+        rss_mb=round(usage.get('Rss', 0), 1),
+        pss_mb=round(usage.get('Pss', 0), 1),
+        private_mb=round(usage.get('Private_Clean', 0) + usage.get('Private_Dirty', 0), 1),
+    )
+
+
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    return repr(value) if isinstance(value, float) else str(int(value))
+
+
+def _format_sample(name, labelnames, labels, value):
+    if labelnames:
+        pairs = ','.join(
+            '{}="{}"'.format(
+                labelname,
+                str(label).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'),
+            )
+            for labelname, label in zip(labelnames, labels)
+        )
+        name = f'{name}{{{pairs}}}'
+    return f'{name} {_format_value(value)}'
+
+
+def _format_header(name, kind, documentation):
+    return [f'# HELP {name} {documentation}', f'# TYPE {name} {kind}']
+
+
+class Counter:
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = dict() if labelnames else {(): 0}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def expose(self):
+        with self._lock:
+            values = dict(self._values)
+        lines = _format_header(self.name, 'counter', self.documentation)
+        for labels, value in sorted(values.items()):
+            lines.append(_format_sample(self.name, self.labelnames, labels, value))
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # label values -> [[count per bucket, then above the last bucket], sum]
+        self._series = dict()
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][i] += 1
+            series[1] += value
+
+    @contextmanager
+    def time(self, *labels):
+        """Observe how long the `with` block takes"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *labels)
+
+    def expose(self):
+        with self._lock:
+            series = {labels: (list(counts), total) for labels, (counts, total) in self._series.items()}
+        lines = _format_header(self.name, 'histogram', self.documentation)
+        bucket_labelnames = self.labelnames + ('le',)
+        for labels, (counts, total) in sorted(series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                lines.append(_format_sample(
+                    f'{self.name}_bucket', bucket_labelnames, labels + (_format_value(float(bound)),), cumulative
+                ))
+            lines.append(_format_sample(f'{self.name}_sum', self.labelnames, labels, total))
+            lines.append(_format_sample(f'{self.name}_count', self.labelnames, labels, cumulative))
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+
+    def counter(self, name, documentation, labelnames=()):
+        metric = Counter(name, documentation, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        metric = Histogram(name, documentation, labelnames, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def collector(self, collect):
+        """
+        Register `collect()`, called on every scrape; it yields
+        (name, kind, documentation, labelnames, {label values: value}) tuples,
+        kind being 'gauge' or 'counter'. Usable as a decorator.
+        """
+        self._collectors.append(collect)
+        return collect
+
+    def expose(self):
+        """All metrics in the text exposition format"""
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.expose())
+        for collect in self._collectors:
+            for name, kind, documentation, labelnames, values in collect():
+                lines.extend(_format_header(name, kind, documentation))
+                for labels, value in values.items():
+                    lines.append(_format_sample(name, labelnames, labels, value))
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = MetricsRegistry()
+
+REQUEST_LATENCY = REGISTRY.histogram(
+    'webshop_request_duration_seconds', 'Time to serve a request, per route.', ['route']
+)
+SEARCH_LATENCY = REGISTRY.histogram(
+    'webshop_search_duration_seconds', 'Time to find the products for a search, including search cache hits.'
+)
+RENDER_LATENCY = REGISTRY.histogram(
+    'webshop_render_duration_seconds', 'Time to render a page, per route.', ['route']
+)
+REWARD_LATENCY = REGISTRY.histogram(
+    'webshop_reward_duration_seconds', 'Time to score a purchase.'
+)
+SESSIONS_STARTED = REGISTRY.counter(
+    'webshop_sessions_started_total', 'Sessions started by this process.'
+)
+SESSIONS_DONE = REGISTRY.counter(
+    'webshop_sessions_done_total', 'Sessions completed with a purchase by this process.'
+)
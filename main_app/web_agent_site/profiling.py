@@ -0,0 +1,357 @@
+"""
+Sampling profiler for the web app's requests, switched on at runtime.
+
+While profiling is on, a fraction of the requests (or those sent with the
+PROFILE_HEADER header) are profiled: a background thread samples the stack
+of each profiled request's thread every `interval` seconds. Samples are
+aggregated per route, and the last profiled requests are kept on their own,
+as collapsed stacks (`frame;frame;frame count` lines) that flamegraph.pl,
+speedscope or inferno render directly.
+
+With several gunicorn workers, the switch and its settings are shared
+through PROFILE_DIR: every worker picks up a change within
+PROFILE_SYNC_INTERVAL seconds, and writes its profiles there as
+`profile-<pid>.json`, which `status` and `collapsed` merge. Profiles of a
+worker other than the one answering are up to PROFILE_SYNC_INTERVAL seconds
+old.
+
+Served by the /admin/profile endpoints of app.py.
+"""
+import glob
+import itertools
+import json
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter, deque
+
+from flask import Flask
+
+from web_agent_site.utils import BASE_DIR
+
+PROFILE_SAMPLE_RATE = float(os.getenv('PROFILE_SAMPLE_RATE', '0'))
+PROFILE_INTERVAL = float(os.getenv('PROFILE_INTERVAL', '0.005'))
+PROFILE_HEADER = os.getenv('PROFILE_HEADER', 'X-Webshop-Profile')
+PROFILE_KEEP_REQUESTS = int(os.getenv('PROFILE_KEEP_REQUESTS', '50'))
+PROFILE_DIR = os.getenv('PROFILE_DIR', os.path.join(BASE_DIR, '../data/profiles'))
+PROFILE_SYNC_INTERVAL = float(os.getenv('PROFILE_SYNC_INTERVAL', '1'))
+
+# frames below the request handling (server, WSGI, Flask internals) are left out
+_ROOT_CODE = Flask.full_dispatch_request.__code__
+
+
+def collapse_stack(frame):
+    """`frame`'s call stack, outermost first, as a collapsed stack line"""
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        # package/module.py, e.g. flask/app.py and web_agent_site/app.py
+        filename = '/'.join(code.co_filename.split(os.sep)[-2:])
+        names.append(f'{code.co_name} ({filename}:{code.co_firstlineno})')
+        if code is _ROOT_CODE:
+            break
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+class RequestProfile:
+    def __init__(self, request_id, route, url):
+        self.request_id = request_id
+        self.route = route
+        self.url = url
+        self.started = time.perf_counter()
+        self.duration = None
+        self.stacks = Counter()
+
+    def summary(self):
+        return dict(
+            request_id=self.request_id,
+            route=self.route,
+            url=self.url,
+            duration_ms=round(1000 * self.duration, 3) if self.duration is not None else None,
+            samples=sum(self.stacks.values()),
+        )
+
+
+class RequestProfiler:
+    def __init__(self, rate=PROFILE_SAMPLE_RATE, interval=PROFILE_INTERVAL,
+                 header=PROFILE_HEADER, keep_requests=PROFILE_KEEP_REQUESTS,
+                 state_dir=PROFILE_DIR, sync_interval=PROFILE_SYNC_INTERVAL):
+        self.rate = rate
+        self.interval = interval
+        self.header = header
+        self.enabled = rate > 0
+        self.keep_requests = keep_requests
+        # None: profiles and settings stay in this process
+        self.state_dir = state_dir
+        self.sync_interval = sync_interval
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        # thread id -> RequestProfile being sampled
+        self._active = dict()
+        # route -> [profiled requests, total seconds, collapsed stack counts]
+        self._routes = dict()
+        self._recent = deque(maxlen=keep_requests)
+        self._thread = None
+        self._pid = None
+        # shared state: settings file mtime seen, its reset generation, next check
+        self._config_mtime = None
+        self._generation = 0
+        self._next_sync = 0.0
+        self._dirty = False
+
+    def configure(self, enabled=None, rate=None, interval=None):
+        """Change the settings, in every worker sharing `state_dir`"""
+        with self._lock:
+            self._apply(enabled, rate, interval)
+        self._write_config()
+
+    def _apply(self, enabled=None, rate=None, interval=None):
+        if rate is not None:
+            self.rate = min(max(rate, 0.0), 1.0)
+        if interval is not None:
+            self.interval = max(interval, 0.0005)
+        if enabled is not None:
+            self.enabled = enabled
+
+    def should_profile(self, headers):
+        self.sync()
+        if not self.enabled:
+            return False
+        return headers.get(self.header) is not None or random.random() < self.rate
+
+    def start(self, route, url):
+        """Start sampling the calling thread for a request to `route`"""
+        profile = RequestProfile(f'{os.getpid()}-{next(self._ids)}', route, url)
+        self._ensure_thread()
+        with self._lock:
+            self._active[threading.get_ident()] = profile
+            self._wakeup.notify()
+        return profile
+
+    def stop(self, profile):
+        profile.duration = time.perf_counter() - profile.started
+        with self._lock:
+            self._active.pop(threading.get_ident(), None)
+            route = self._routes.setdefault(profile.route, [0, 0.0, Counter()])
+            route[0] += 1
+            route[1] += profile.duration
+            route[2].update(profile.stacks)
+            self._recent.append(profile)
+            self._dirty = True
+
+    def _ensure_thread(self):
+        # like any thread, the sampler does not survive fork(): one per process
+        if self._thread is None or self._pid != os.getpid():
+            with self._lock:
+                if self._thread is None or self._pid != os.getpid():
+                    self._active = dict()
+                    self._pid = os.getpid()
+                    self._thread = threading.Thread(target=self._run, name='request-profiler', daemon=True)
+                    self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._lock:
+                if not self._active:
+                    # an idle worker still shares its last profiles
+                    self._wakeup.wait(self.sync_interval if self.state_dir is not None else None)
+                active = bool(self._active)
+                dirty = self._dirty
+                interval = self.interval
+            if not active:
+                if dirty:
+                    self.sync(force=True)
+                continue
+            time.sleep(interval)
+            frames = sys._current_frames()
+            with self._lock:
+                for thread_id, profile in self._active.items():
+                    frame = frames.get(thread_id)
+                    if frame is not None:
+                        profile.stacks[collapse_stack(frame)] += 1
+            del frames
+
+    # settings and profiles shared by the workers through `state_dir`
+
+    def _config_path(self):
+        return os.path.join(self.state_dir, 'config.json')
+
+    def _profile_path(self, pid):
+        return os.path.join(self.state_dir, f'profile-{pid}.json')
+
+    def sync(self, force=False):
+        """Pick up settings changed by another worker and write this worker's profiles"""
+        if self.state_dir is None:
+            return
+        now = time.monotonic()
+        if not force and now < self._next_sync:
+            return
+        self._next_sync = now + self.sync_interval
+        self._read_config()
+        if self._dirty:
+            self._write_profiles()
+
+    def _read_config(self):
+        try:
+            mtime = os.stat(self._config_path()).st_mtime_ns
+            if mtime == self._config_mtime:
+                return
+            with open(self._config_path()) as f:
+                config = json.load(f)
+        except (OSError, ValueError):
+            return
+        with self._lock:
+            self._config_mtime = mtime
+            self._apply(config.get('enabled'), config.get('rate'), config.get('interval'))
+            if config.get('generation', 0) != self._generation:
+                # profiles were dropped (DELETE /admin/profile) in another worker
+                self._generation = config.get('generation', 0)
+                self._clear()
+
+    def _write_config(self):
+        if self.state_dir is None:
+            return
+        with self._lock:
+            config = dict(enabled=self.enabled, rate=self.rate, interval=self.interval,
+                          generation=self._generation)
+        try:
+            _write_json(self._config_path(), config)
+            self._config_mtime = os.stat(self._config_path()).st_mtime_ns
+        except OSError as e:
+            print(f'Could not share the profiler settings: {e}')
+
+    def _write_profiles(self):
+        with self._lock:
+            data = dict(
+                routes={name: [count, total, dict(stacks)] for name, (count, total, stacks) in self._routes.items()},
+                recent=[dict(profile.summary(), stacks=dict(profile.stacks)) for profile in self._recent],
+            )
+            self._dirty = False
+        try:
+            _write_json(self._profile_path(os.getpid()), data)
+        except OSError as e:
+            print(f'Could not write the request profiles: {e}')
+
+    def _profiles(self):
+        """(route -> [requests, seconds, stacks], recent profiles, pids) of all workers"""
+        self.sync(force=True)
+        with self._lock:
+            own = dict(
+                routes={name: [count, total, dict(stacks)] for name, (count, total, stacks) in self._routes.items()},
+                recent=[dict(profile.summary(), stacks=dict(profile.stacks)) for profile in self._recent],
+            )
+        workers = {os.getpid(): own}
+        if self.state_dir is not None:
+            for path in glob.glob(os.path.join(self.state_dir, 'profile-*.json')):
+                pid = int(os.path.basename(path)[len('profile-'):-len('.json')])
+                if pid == os.getpid():
+                    continue
+                try:
+                    with open(path) as f:
+                        workers[pid] = json.load(f)
+                except (OSError, ValueError):
+                    continue
+        routes = dict()
+        recent = []
+        for data in workers.values():
+            for name, (count, total, stacks) in data['routes'].items():
+                route = routes.setdefault(name, [0, 0.0, Counter()])
+                route[0] += count
+                route[1] += total
+                route[2].update(stacks)
+            recent.extend(data['recent'])
+        recent.sort(key=lambda profile: profile['duration_ms'], reverse=True)
+        return routes, recent[:self.keep_requests], sorted(workers)
+
+    def status(self):
+        routes, recent, pids = self._profiles()
+        return dict(
+            enabled=self.enabled,
+            rate=self.rate,
+            interval=self.interval,
+            header=self.header,
+            pid=os.getpid(),
+            workers=pids,
+            routes={
+                name: dict(
+                    requests=count,
+                    mean_ms=round(1000 * total / count, 3),
+                    samples=sum(stacks.values()),
+                )
+                for name, (count, total, stacks) in routes.items()
+            },
+            recent=[{key: value for key, value in profile.items() if key != 'stacks'} for profile in recent],
+        )
+
+    def collapsed(self, route=None, request_id=None):
+        """
+        Collapsed stacks of one kept request, of one route, or of all routes
+        (with the route as the root frame), merged across workers; None if
+        there is no such profile
+        """
+        routes, recent, _ = self._profiles()
+        if request_id is not None:
+            for profile in recent:
+                if profile['request_id'] == request_id:
+                    return _format_collapsed(profile['stacks'])
+            return None
+        if route is not None:
+            if route not in routes:
+                return None
+            return _format_collapsed(routes[route][2])
+        stacks = Counter()
+        for name, (_, _, route_stacks) in routes.items():
+            for stack, count in route_stacks.items():
+                stacks[f'{name};{stack}'] += count
+        return _format_collapsed(stacks)
+
+    def _clear(self):
+        self._routes.clear()
+        self._recent.clear()
+        self._dirty = False
+
+    def reset(self):
+        """Drop the profiles collected so far, in every worker"""
+        with self._lock:
+            self._clear()
+            self._generation += 1
+        self._remove_profiles()
+        self._write_config()
+
+    def reset_shared_state(self):
+        """Forget the settings and profiles of a previous server run"""
+        if self.state_dir is None:
+            return
+        self._remove_profiles()
+        try:
+            os.remove(self._config_path())
+        except OSError:
+            pass
+
+    def _remove_profiles(self):
+        if self.state_dir is None:
+            return
+        for path in glob.glob(os.path.join(self.state_dir, 'profile-*.json')):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+def _write_json(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+
+def _format_collapsed(stacks):
+    return ''.join(f'{stack} {count}\n' for stack, count in sorted(stacks.items()))
+
+
+PROFILER = RequestProfiler()
@@ -0,0 +1,150 @@
+"""
+Segmented trajectory log store (TRAJECTORY_LOG_BACKEND=segments).
+
+Instead of one `<session_id>.jsonl` file per session, each writer process
+appends the records of all sessions to size-rotated segment files in the log
+directory, each with a small offset index:
+
+    segment-<time ns>-<pid>.seg   trajectory records, as JSON lines
+    segment-<time ns>-<pid>.idx   one line per run of a session's records:
+                                  session id, offset, length, time, start
+
+`time` is when the first record of the run was logged; it orders a session's
+runs across writer processes. `start` is 1 when the run begins a new log for
+the session (the session header record), replacing anything logged before.
+
+Readers only tail the index files and then read the session's byte ranges.
+This module only depends on the standard library (and runs on the observer
+image's Python 3.8, which copies it at build time), so tools outside the app
+can use it too:
+
+    python -m web_agent_site.segment_log list user_session_logs/mturk
+    python -m web_agent_site.segment_log extract user_session_logs/mturk fixed_0
+    python -m web_agent_site.segment_log export user_session_logs/mturk logs_out
+"""
+import argparse
+import os
+import sys
+from collections import defaultdict, namedtuple
+
+SEGMENT_PREFIX = 'segment-'
+SEGMENT_SUFFIX = '.seg'
+INDEX_SUFFIX = '.idx'
+
+IndexEntry = namedtuple('IndexEntry', ['time', 'segment', 'offset', 'length', 'start'])
+
+
+def segment_paths(log_dir, pid, time_ns):
+    """Paths of a new segment file and its index"""
+    base = os.path.join(log_dir, f'{SEGMENT_PREFIX}{time_ns}-{pid}')
+    return base + SEGMENT_SUFFIX, base + INDEX_SUFFIX
+
+
+def index_line(session_id, offset, length, time, start):
+    return f'{session_id}\t{offset}\t{length}\t{time:.6f}\t{int(start)}\n'
+
+
+class SegmentLogReader:
+    def __init__(self, log_dir):
+        self.log_dir = log_dir
+        # index file name -> bytes read so far
+        self._positions = dict()
+        # session id -> [IndexEntry]
+        self._entries = defaultdict(list)
+
+    def refresh(self):
+        """Read the index lines appended since the last call"""
+        try:
+            names = {
+                name for name in os.listdir(self.log_dir)
+                if name.startswith(SEGMENT_PREFIX) and name.endswith(INDEX_SUFFIX)
+            }
+        except FileNotFoundError:
+            names = set()
+        if any(name not in names for name in self._positions):
+            # segments were cleaned up or moved away: start over
+            self._positions.clear()
+            self._entries.clear()
+        for name in sorted(names):
+            position = self._positions.get(name, 0)
+            try:
+                with open(os.path.join(self.log_dir, name), 'rb') as f:
+                    f.seek(position)
+                    data = f.read()
+            except FileNotFoundError:
+                continue
+            # leave a line still being written for the next refresh
+            end = data.rfind(b'\n') + 1
+            segment = name[:-len(INDEX_SUFFIX)] + SEGMENT_SUFFIX
+            for line in data[:end].decode('utf-8').splitlines():
+                session_id, offset, length, time, start = line.split('\t')
+                self._entries[session_id].append(
+                    IndexEntry(float(time), segment, int(offset), int(length), start == '1')
+                )
+            self._positions[name] = position + end
+
+    def sessions(self):
+        self.refresh()
+        return sorted(self._entries)
+
+    def read(self, session_id):
+        """The session's log as JSON lines (bytes), empty if it has none"""
+        self.refresh()
+        entries = sorted(self._entries.get(session_id, ()))
+        starts = [i for i, entry in enumerate(entries) if entry.start]
+        if starts:
+            entries = entries[starts[-1]:]
+        files = dict()
+        chunks = []
+        try:
+            for entry in entries:
+                f = files.get(entry.segment)
+                if f is None:
+                    f = files[entry.segment] = open(os.path.join(self.log_dir, entry.segment), 'rb')
+                f.seek(entry.offset)
+                chunks.append(f.read(entry.length))
+        finally:
+            for f in files.values():
+                f.close()
+        return b''.join(chunks)
+
+    def lines(self, session_id):
+        return self.read(session_id).decode('utf-8').splitlines(keepends=True)
+
+
+def export_sessions(log_dir, out_dir):
+    """Write every session in `log_dir` to `out_dir/<session_id>.jsonl`"""
+    reader = SegmentLogReader(log_dir)
+    os.makedirs(out_dir, exist_ok=True)
+    sessions = reader.sessions()
+    for session_id in sessions:
+        with open(os.path.join(out_dir, f'{session_id}.jsonl'), 'wb') as f:
+            f.write(reader.read(session_id))
+    return sessions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Read segmented WebShop trajectory logs")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    list_parser = subparsers.add_parser('list', help="List the logged session ids")
+    list_parser.add_argument('log_dir')
+    extract_parser = subparsers.add_parser('extract', help="Print one session's log")
+    extract_parser.add_argument('log_dir')
+    extract_parser.add_argument('session_id')
+    export_parser = subparsers.add_parser('export', help="Write one <session_id>.jsonl file per session")
+    export_parser.add_argument('log_dir')
+    export_parser.add_argument('out_dir')
+    args = parser.parse_args()
+
+    if args.command == 'list':
+        for session_id in SegmentLogReader(args.log_dir).sessions():
+            print(session_id)
+    elif args.command == 'extract':
+        sys.stdout.buffer.write(SegmentLogReader(args.log_dir).read(args.session_id))
+    elif args.command == 'export':
+        sessions = export_sessions(args.log_dir, args.out_dir)
+        print(f'Exported {len(sessions)} sessions to {args.out_dir}')
+
+
+if __name__ == '__main__':
+    main()
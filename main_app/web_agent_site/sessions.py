@@ -0,0 +1,146 @@
+"""
+Session stores for the web app.
+
+A session is the small dict the app keeps per session id (goal, done flag,
+reward). Two backends, selected with SESSION_STORE:
+
+* `memory` - bounded LRU in this process; sessions expire SESSION_TTL
+  seconds after they were last written,
+* `sqlite` - a SQLite database in WAL mode at SESSION_DB_PATH, shared by all
+  worker processes, so any gunicorn worker can serve any session. Expired
+  sessions are pruned periodically.
+
+The default is `memory`, or `sqlite` with more than one gunicorn worker
+(WEB_CONCURRENCY > 1). Either way the app clears the store when a server
+starts, so a restart still resets a run.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+from os.path import join
+
+from web_agent_site.cache import LRUCache
+from web_agent_site.utils import BASE_DIR
+
+SESSION_STORE = os.getenv('SESSION_STORE') or (
+    'sqlite' if int(os.getenv('WEB_CONCURRENCY', '1')) > 1 else 'memory'
+)
+SESSION_TTL = float(os.getenv('SESSION_TTL', str(24 * 60 * 60)))
+SESSION_MAX = int(os.getenv('SESSION_MAX', '100000'))
+SESSION_DB_PATH = os.getenv('SESSION_DB_PATH', join(BASE_DIR, '../data/sessions.sqlite3'))
+# prune expired sqlite sessions every N writes
+SESSION_PRUNE_EVERY = 1000
+
+
+class SessionStore:
+    """Mapping-like interface shared by the session stores"""
+
+    def get(self, session_id):
+        """The session, or None when it does not exist or expired"""
+        raise NotImplementedError
+
+    def set(self, session_id, session):
+        """Create or replace a session; changes to a session must be set back"""
+        raise NotImplementedError
+
+    def __getitem__(self, session_id):
+        session = self.get(session_id)
+        if session is None:
+            raise KeyError(session_id)
+        return session
+
+    def __setitem__(self, session_id, session):
+        self.set(session_id, session)
+
+    def __contains__(self, session_id):
+        return self.get(session_id) is not None
+
+    def clear(self):
+        """Delete every session"""
+        raise NotImplementedError
+
+    def __len__(self):
+        raise NotImplementedError
+
+
+class MemorySessionStore(SessionStore):
+    def __init__(self, maxsize=SESSION_MAX, ttl=SESSION_TTL):
+        self._sessions = LRUCache(maxsize, ttl=ttl)
+
+    def get(self, session_id):
+        return self._sessions.get(session_id)
+
+    def set(self, session_id, session):
+        self._sessions.put(session_id, session)
+
+    def clear(self):
+        self._sessions.clear()
+
+    def __len__(self):
+        return len(self._sessions)
+
+
+class SqliteSessionStore(SessionStore):
+    def __init__(self, path=SESSION_DB_PATH, ttl=SESSION_TTL):
+        self.path = path
+        self.ttl = ttl
+        self._local = threading.local()
+        self._writes = 0
+        with self._connection() as conn:
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS sessions ('
+                'session_id TEXT PRIMARY KEY, data TEXT NOT NULL, updated REAL NOT NULL)'
+            )
+            conn.execute('CREATE INDEX IF NOT EXISTS sessions_updated ON sessions (updated)')
+
+    def _connection(self):
+        # one connection per thread (and per process, as pids change on fork)
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def get(self, session_id):
+        row = self._connection().execute(
+            'SELECT data FROM sessions WHERE session_id = ? AND updated > ?',
+            (session_id, time.time() - self.ttl),
+        ).fetchone()
+        return json.loads(row[0]) if row is not None else None
+
+    def set(self, session_id, session):
+        conn = self._connection()
+        conn.execute(
+            'INSERT OR REPLACE INTO sessions (session_id, data, updated) VALUES (?, ?, ?)',
+            (session_id, json.dumps(session), time.time()),
+        )
+        self._writes += 1
+        if self._writes % SESSION_PRUNE_EVERY == 0:
+            self.prune()
+
+    def clear(self):
+        self._connection().execute('DELETE FROM sessions')
+
+    def prune(self):
+        """Delete expired sessions"""
+        self._connection().execute(
+            'DELETE FROM sessions WHERE updated <= ?', (time.time() - self.ttl,)
+        )
+
+    def __len__(self):
+        return self._connection().execute(
+            'SELECT COUNT(*) FROM sessions WHERE updated > ?', (time.time() - self.ttl,)
+        ).fetchone()[0]
+
+
+def create_session_store(backend=SESSION_STORE):
+    if backend == 'memory':
+        return MemorySessionStore()
+    elif backend == 'sqlite':
+        return SqliteSessionStore()
+    raise ValueError(f'Unknown session store {backend!r}, expected memory or sqlite.')
@@ -0,0 +1,291 @@
+"""
+Asynchronous writers for the trajectory logs (`user_session_logs/mturk`).
+
+Request threads only put records on a queue; a background thread encodes
+them, groups them per session and appends each batch with a single write, so
+readers tailing the logs never see partial lines. Two backends, selected with
+TRAJECTORY_LOG_BACKEND:
+
+* `files` (default) - one `<session_id>.jsonl` file per session, with the
+  open files kept in a bounded LRU pool,
+* `segments` - the sessions of a process share size-rotated segment files
+  with an offset index (see segment_log.py), so a run does not create
+  thousands of small files, and the logs of sessions served by several
+  worker processes stay in order.
+
+Log schema version 2: a log starts with a session header record
+`{"v": 2, "type": "session", "session_id": ..., "goal": {...}}`, followed by
+one record per page visit `{"v": 2, "page": ..., "url": ..., ...}` that no
+longer repeats the goal. Version 1 logs (no "v" field) embedded the goal in
+every record; `analytics_script/import_script.py` reads both.
+"""
+import atexit
+import json
+import os
+import queue
+import threading
+import time
+from collections import OrderedDict, defaultdict
+
+from web_agent_site.segment_log import index_line, segment_paths
+
+TRAJECTORY_LOG_BACKEND = os.getenv('TRAJECTORY_LOG_BACKEND', 'files')
+TRAJECTORY_LOG_MAX_OPEN = int(os.getenv('TRAJECTORY_LOG_MAX_OPEN', '64'))
+TRAJECTORY_LOG_BATCH = int(os.getenv('TRAJECTORY_LOG_BATCH', '256'))
+TRAJECTORY_LOG_FLUSH_INTERVAL = float(os.getenv('TRAJECTORY_LOG_FLUSH_INTERVAL', '0.2'))
+TRAJECTORY_SEGMENT_BYTES = int(os.getenv('TRAJECTORY_SEGMENT_BYTES', str(64 * 1024 * 1024)))
+# seconds close() waits for the writer thread to finish the queued records
+TRAJECTORY_LOG_CLOSE_TIMEOUT = float(os.getenv('TRAJECTORY_LOG_CLOSE_TIMEOUT', '30'))
+
+LOG_SCHEMA_VERSION = 2
+
+_OPEN, _WRITE, _CLOSE, _FLUSH, _STOP = range(5)
+
+
+class TrajectoryLogWriter:
+    def __init__(self, log_dir, max_open=TRAJECTORY_LOG_MAX_OPEN,
+                 batch_size=TRAJECTORY_LOG_BATCH, flush_interval=TRAJECTORY_LOG_FLUSH_INTERVAL):
+        self.log_dir = log_dir
+        self.max_open = max_open
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue = None
+        self._thread = None
+        self._pid = None
+        self._start_lock = threading.Lock()
+        self._reset()
+        atexit.register(self.close)
+
+    def path(self, session_id):
+        return os.path.join(self.log_dir, f'{session_id}.jsonl')
+
+    def open_session(self, session_id, goal):
+        """Start a new log for `session_id` with its session header record"""
+        self._put((_OPEN, session_id, None))
+        self.write(session_id, dict(type='session', session_id=session_id, goal=goal))
+
+    def write(self, session_id, record):
+        """Append `record` (a JSON serializable dict) to the session's log"""
+        self._put((_WRITE, session_id, (time.time(), record)))
+
+    def close_session(self, session_id):
+        """Release what the session holds, e.g. once it is done"""
+        self._put((_CLOSE, session_id, None))
+
+    def flush(self, timeout=None):
+        """Block until everything queued so far is written"""
+        if self._thread is None or self._pid != os.getpid():
+            return
+        done = threading.Event()
+        self._queue.put((_FLUSH, None, done))
+        done.wait(timeout)
+
+    def close(self, timeout=TRAJECTORY_LOG_CLOSE_TIMEOUT):
+        """Write pending records, close every file and stop the writer thread"""
+        if self._thread is None or self._pid != os.getpid():
+            return
+        self._queue.put((_STOP, None, None))
+        self._thread.join(timeout)
+        if self._thread.is_alive():
+            print(f'Trajectory log writer did not stop within {timeout}s, records may be lost.')
+        self._thread = None
+
+    def _put(self, item):
+        # the writer thread does not survive fork(): start one per process
+        if self._thread is None or self._pid != os.getpid():
+            with self._start_lock:
+                if self._thread is None or self._pid != os.getpid():
+                    self._reset()
+                    self._queue = queue.SimpleQueue()
+                    self._pid = os.getpid()
+                    self._thread = threading.Thread(
+                        target=self._run, name='trajectory-log', daemon=True
+                    )
+                    self._thread.start()
+        self._queue.put(item)
+
+    def _run(self):
+        while True:
+            try:
+                items = [self._queue.get(timeout=self.flush_interval)]
+            except queue.Empty:
+                continue
+            while len(items) < self.batch_size:
+                try:
+                    items.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                if not self._process(items):
+                    return
+            except Exception as e:
+                # keep the thread alive: a dead writer would leave the queue
+                # growing and flush() waiting forever
+                print(f'Trajectory log writer dropped a batch of {len(items)} items: {type(e).__name__}: {e}')
+                for kind, _, payload in items:
+                    if kind == _FLUSH:
+                        payload.set()
+                    elif kind == _STOP:
+                        self._close_all()
+                        return
+
+    def _process(self, items):
+        """Apply a batch in order; returns False once asked to stop"""
+        # session id -> [(time logged, encoded record)]
+        pending = defaultdict(list)
+        for kind, session_id, payload in items:
+            if kind == _WRITE:
+                logged, record = payload
+                try:
+                    record = dict(v=LOG_SCHEMA_VERSION, **record)
+                    pending[session_id].append((logged, json.dumps(record) + '\n'))
+                except (TypeError, ValueError) as e:
+                    print(f'Dropping trajectory record of {session_id}: {e}')
+                continue
+            self._write_pending(pending)
+            if kind == _OPEN:
+                self._open_session(session_id)
+            elif kind == _CLOSE:
+                self._close_session(session_id)
+            elif kind == _FLUSH:
+                payload.set()
+            elif kind == _STOP:
+                self._close_all()
+                return False
+        self._write_pending(pending)
+        return True
+
+    # per backend: what a process holds, and how batches are written
+
+    def _reset(self):
+        # session id -> open file, least recently used first
+        self._files = OrderedDict()
+
+    def _open_session(self, session_id):
+        try:
+            self._open(session_id, truncate=True)
+        except OSError as e:
+            print(f'Could not create trajectory log of {session_id}: {e}')
+
+    def _close_session(self, session_id):
+        f = self._files.pop(session_id, None)
+        if f is not None:
+            f.close()
+
+    def _close_all(self):
+        for f in self._files.values():
+            f.close()
+        self._files.clear()
+
+    def _write_pending(self, pending):
+        for session_id, lines in pending.items():
+            try:
+                f = self._files.get(session_id)
+                if f is None:
+                    f = self._open(session_id)
+                else:
+                    self._files.move_to_end(session_id)
+                f.write(''.join(line for _, line in lines).encode('utf-8'))
+            except OSError as e:
+                print(f'Could not write trajectory log of {session_id}: {e}')
+        pending.clear()
+
+    def _open(self, session_id, truncate=False):
+        f = self._files.pop(session_id, None)
+        if f is not None:
+            f.close()
+        if truncate:
+            open(self.path(session_id), 'wb').close()
+        # unbuffered append: one write() per batch keeps lines whole
+        f = open(self.path(session_id), 'ab', buffering=0)
+        self._files[session_id] = f
+        while len(self._files) > self.max_open:
+            _, oldest = self._files.popitem(last=False)
+            oldest.close()
+        return f
+
+
+class SegmentedLogWriter(TrajectoryLogWriter):
+    """
+    Appends the records of all sessions to this process' current segment; a
+    batch is one write to the segment and one to its index.
+    """
+
+    def __init__(self, log_dir, segment_bytes=TRAJECTORY_SEGMENT_BYTES, **kwargs):
+        self.segment_bytes = segment_bytes
+        super().__init__(log_dir, **kwargs)
+
+    def _reset(self):
+        # (segment path, index path, segment file, index file)
+        self._segment = None
+        self._segment_size = 0
+        # sessions whose next run starts a new log
+        self._starting = set()
+
+    def _open_session(self, session_id):
+        self._starting.add(session_id)
+
+    def _close_session(self, session_id):
+        pass
+
+    def _close_all(self):
+        self._close_segment()
+
+    def _write_pending(self, pending):
+        if not pending:
+            return
+        try:
+            segment, index = self._current_segment()
+            offset = self._segment_size
+            chunks, entries = [], []
+            for session_id, lines in pending.items():
+                chunk = ''.join(line for _, line in lines).encode('utf-8')
+                start = session_id in self._starting
+                entries.append(index_line(session_id, offset, len(chunk), lines[0][0], start))
+                chunks.append(chunk)
+                offset += len(chunk)
+            # data before index, so the index never points past the data
+            segment.write(b''.join(chunks))
+            index.write(''.join(entries).encode('utf-8'))
+            self._segment_size = offset
+            self._starting.difference_update(pending)
+            if self._segment_size >= self.segment_bytes:
+                self._close_segment()
+        except OSError as e:
+            print(f'Could not write trajectory log segment: {e}')
+        pending.clear()
+
+    def _current_segment(self):
+        if self._segment is not None and not self._segment_moved():
+            return self._segment[2:]
+        self._close_segment()
+        segment_path, index_path = segment_paths(self.log_dir, os.getpid(), time.time_ns())
+        segment = open(segment_path, 'ab', buffering=0)
+        index = open(index_path, 'ab', buffering=0)
+        self._segment = (segment_path, index_path, segment, index)
+        self._segment_size = 0
+        return segment, index
+
+    def _segment_moved(self):
+        """Whether the segment files were removed or moved away, e.g. by the observer"""
+        for path, f in zip(self._segment[:2], self._segment[2:]):
+            try:
+                if os.stat(path).st_ino != os.fstat(f.fileno()).st_ino:
+                    return True
+            except FileNotFoundError:
+                return True
+        return False
+
+    def _close_segment(self):
+        if self._segment is not None:
+            for f in self._segment[2:]:
+                f.close()
+            self._segment = None
+
+
+def create_trajectory_log(log_dir, backend=TRAJECTORY_LOG_BACKEND):
+    if backend == 'files':
+        return TrajectoryLogWriter(log_dir)
+    elif backend == 'segments':
+        return SegmentedLogWriter(log_dir)
+    raise ValueError(f'Unknown trajectory log backend {backend!r}, expected files or segments.')
@@ -26,6 +26,8 @@ if DATASET_SOURCE == "all":
     DEFAULT_FILE_PATH = join(BASE_DIR, '../data/items_shuffle.json')
 
 DEFAULT_REVIEW_PATH = join(BASE_DIR, '../data/reviews.json')
+DEFAULT_SNAPSHOT_PATH = join(BASE_DIR, f'../data/catalog_{DATASET_SOURCE}.snapshot')
+DEFAULT_MANIFEST_PATH = join(BASE_DIR, f'../data/manifest_{DATASET_SOURCE}.json')
 
 
 FEAT_CONV = join(BASE_DIR, '../data/feat_conv.pt')
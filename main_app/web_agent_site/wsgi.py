@@ -0,0 +1,61 @@
+"""
+WSGI entry point for production serving (see gunicorn.conf.py).
+
+The gunicorn master binds the port first and then calls `preload`, which
+builds the catalog, goals and search matrices once, before the workers are
+forked, so they share them copy-on-write. Meanwhile the master answers
+/healthz and /readyz itself (with the loading progress) and 503 to every
+other page. Served by another WSGI server, the app loads its data on the
+first session page instead.
+
+Options of the development server map to environment variables:
+WEBSHOP_LOG=1 (--log) and WEBSHOP_ATTRS=1 (--attrs).
+"""
+import os
+import socket
+import threading
+
+from werkzeug.serving import make_server
+
+from web_agent_site.app import app, configure, load_data
+
+PROBE_PATHS = ('/healthz', '/readyz')
+
+configure(
+    log=os.getenv('WEBSHOP_LOG', '0') == '1',
+    attrs=os.getenv('WEBSHOP_ATTRS', '0') == '1',
+)
+
+application = app
+
+
+def loading_app(environ, start_response):
+    """Serves the health probes while the data loads, 503 for other pages"""
+    if environ.get('PATH_INFO') in PROBE_PATHS:
+        return app(environ, start_response)
+    start_response('503 Service Unavailable', [
+        ('Content-Type', 'text/plain; charset=utf-8'),
+        ('Retry-After', '30'),
+    ])
+    return [b'WebShop is loading its data, see /readyz for the progress\n']
+
+
+def preload(sockets):
+    """
+    Load the data shared by the forked workers, serving `loading_app` on
+    the already bound (TCP) `sockets` until it is loaded
+    """
+    servers = []
+    for sock in sockets:
+        if sock.family not in (socket.AF_INET, socket.AF_INET6):
+            continue
+        host, port = sock.getsockname()[:2]
+        server = make_server(host, port, loading_app, threaded=True, fd=sock.fileno())
+        threading.Thread(target=server.serve_forever, name='webshop-probes', daemon=True).start()
+        servers.append(server)
+    try:
+        load_data(before_fork=True)
+    finally:
+        for server in servers:
+            server.shutdown()
+            server.server_close()
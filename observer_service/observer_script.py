@@ -9,6 +9,12 @@ import json
 from bs4 import BeautifulSoup
 
 import csv
+import sys
+
+# the observer image has the webshop's segment_log module next to this
+# script; outside of it, import it from main_app
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'main_app'))
+from web_agent_site.segment_log import SegmentLogReader
 
 app = Flask(__name__)
 
@@ -21,6 +27,9 @@ session_details = []  # List to store session details to write in csv
 log_directory = "user_session_logs/mturk"
 BASE_URL = os.environ.get("INTERNAL_URL", "http://localhost:3000")
 DISPLAY_URL = os.environ.get("EXTERNAL_ACCESS_URL", "http://localhost:3000")
+READY_TIMEOUT = int(os.environ.get("WEBSHOP_READY_TIMEOUT", 30 * 60))
+
+segment_logs = SegmentLogReader(log_directory)
 
 def generate_display_url(session_id):
     return f"{DISPLAY_URL}/{session_id}"
@@ -28,6 +37,24 @@ def generate_display_url(session_id):
 def generate_url(session_id):
     return f"{BASE_URL}/{session_id}"
 
+def wait_for_webshop_ready(timeout=READY_TIMEOUT, interval=5):
+    """
+    Poll the webshop readiness probe until its data is loaded. Returns False
+    on timeout or when the observer is stopped meanwhile.
+    """
+    deadline = time.time() + timeout
+    while observer_running and time.time() < deadline:
+        try:
+            response = requests.get(f"{BASE_URL}/readyz", timeout=interval)
+            if response.status_code == 200:
+                return True
+            progress = response.json()
+            print(f"Waiting for webshop to load (stage: {progress.get('stage')}, error: {progress.get('error')})")
+        except (requests.RequestException, ValueError) as e:
+            print(f"Waiting for webshop to come up: {e}")
+        time.sleep(interval)
+    return False
+
 def fetch_instruction(session_id):
     url = generate_url(session_id)
     response = requests.get(url)
@@ -101,30 +128,39 @@ def update_session_details(duration, termination_reason, navigation_steps, sessi
         session_details[-1]["navigation_steps"] = navigation_steps
         session_details[-1]["session_score"] = session_score
 
-def monitor_log(nfig_session_id, session_id):
+def count_navigation_steps(logs):
+    """Page visits in a trajectory log, not counting the v2 session header record"""
+    return sum(1 for line in logs if line.strip() and json.loads(line).get('type') != 'session')
+
+def read_session_log(session_id):
+    """Log lines of a session, from its own JSONL file or the shared log segments"""
     log_file = os.path.join(log_directory, f"{session_id}.jsonl")
+    if os.path.exists(log_file):
+        with open(log_file, 'r') as f:
+            return f.readlines()
+    return segment_logs.lines(session_id)
+
+def monitor_log(nfig_session_id, session_id):
     start_time = time.time()
     timeout = 2 * 60  # 5 minutes in seconds
     navigation_steps = 0
     session_score = None
 
     while observer_running:
-        if os.path.exists(log_file):
-            with open(log_file, 'r') as f:
-                logs = f.readlines()
-                navigation_steps = len(logs)
-                if logs:
-                    last_log = json.loads(logs[-1])
-                    if last_log.get('page') == 'done':
-                        print(f"User reached end state for session {session_id}")
-                        print("stop") # [API REQ] this will in production call an API to my server to terminate a task
-
-                        stop_workflow(nfig_session_id)
-                        end_time = time.time()
-                        session_duration = end_time - start_time
-                        session_score = last_log.get('reward', None)
-                        update_session_details(session_duration, "completed", navigation_steps, session_score)
-                        break
+        logs = read_session_log(session_id)
+        navigation_steps = count_navigation_steps(logs)
+        if logs:
+            last_log = json.loads(logs[-1])
+            if last_log.get('page') == 'done':
+                print(f"User reached end state for session {session_id}")
+                print("stop") # [API REQ] this will in production call an API to my server to terminate a task
+
+                stop_workflow(nfig_session_id)
+                end_time = time.time()
+                session_duration = end_time - start_time
+                session_score = last_log.get('reward', None)
+                update_session_details(session_duration, "completed", navigation_steps, session_score)
+                break
 
         # Check for timeout
         if time.time() - start_time > timeout:
@@ -133,10 +169,7 @@ def monitor_log(nfig_session_id, session_id):
             end_time = time.time()
             session_duration = end_time - start_time
             # Measure the number of lines in the log file for timeout case
-            if os.path.exists(log_file):
-                with open(log_file, 'r') as f:
-                    logs = f.readlines()
-                    navigation_steps = len(logs)
+            navigation_steps = count_navigation_steps(read_session_log(session_id))
             update_session_details(session_duration, "timeout", navigation_steps, None)
             break
 
@@ -148,7 +181,12 @@ def observer_task(session_ids):
     """
     global observer_running
     observer_running = True
-    
+
+    webshop_ready = wait_for_webshop_ready()
+    if not webshop_ready:
+        print("Webshop did not become ready, aborting observation")
+        session_ids = []
+
     for session_id in session_ids:
         if not observer_running:
             update_session_details(0, "stopped", 0, None)
@@ -189,7 +227,9 @@ def observer_task(session_ids):
 
     termination_cause_file = os.path.join(log_directory, "observer_termination_cause")
     with open(termination_cause_file, "w") as file:
-        if observer_running:
+        if not webshop_ready and observer_running:
+            file.write("webshop_not_ready")
+        elif observer_running:
             file.write("completed")
         else:
             file.write("stopped")